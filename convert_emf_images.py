@@ -5,29 +5,43 @@ import tempfile
 import os
 import sys
 import shutil
-import copy
 from bs4 import BeautifulSoup
 import time
+import pathlib
 import re # Added for sanitization
 from PIL import Image # Added for cropping
 import logging
+import json_utils
 
 # --- Configuration (Defaults/Constants) ---
 DEFAULT_OUTPUT_IMAGE_SUBDIR = 'Images' # Subdirectory name for saved intermediate PNGs
 # Path to the LibreOffice executable
 CONVERTER_COMMAND = 'libreoffice'
+# Optional LibreOffice user profile directory. None uses the default profile;
+# concurrent conversions (e.g. parallel pipeline workers) need one each,
+# since headless instances sharing a profile hand off to or block each other.
+LIBREOFFICE_PROFILE_DIR = None
 # Maximum number of retries for failed conversions
 MAX_RETRIES = 2
 # Delay between retries in seconds
 RETRY_DELAY = 1
 # --- End Configuration ---
 
+# Result of the first check_dependencies() call, reused for later files
+_DEPENDENCIES_OK = None
+
+# Data URI prefixes of the metafile images that need converting
+METAFILE_SRC_PREFIXES = ('data:image/x-emf;base64,', 'data:image/x-wmf;base64,')
+
+# Runs of characters that are unsafe in filenames (backslash included)
+_UNSAFE_FILENAME_CHARS_RE = re.compile(r'[\/:"*?<>|\s\\]+')
+
 def sanitize_filename(name):
     """Removes or replaces characters unsafe for filenames."""
     # Remove leading/trailing whitespace
     name = name.strip()
     # Replace problematic characters with underscores
-    name = re.sub(r'[\/:"*?<>|\s\\]+', '_', name) # Added backslash to problematic chars
+    name = _UNSAFE_FILENAME_CHARS_RE.sub('_', name)
     # Limit length if necessary (optional)
     max_len = 50
     name = name[:max_len]
@@ -83,8 +97,14 @@ def crop_whitespace(image_path, padding=0, threshold=230):
         logging.error(f"      Error cropping {os.path.basename(image_path)}: {e}")
 
 def check_dependencies():
-    """Checks if the required converter command is available."""
-    global CONVERTER_COMMAND
+    """Checks if the required converter command is available.
+
+    The lookup runs once per process; CONVERTER_COMMAND is replaced with the
+    resolved absolute path so each conversion skips the PATH search too.
+    """
+    global CONVERTER_COMMAND, _DEPENDENCIES_OK
+    if _DEPENDENCIES_OK is not None:
+        return _DEPENDENCIES_OK
     converter_path = shutil.which(CONVERTER_COMMAND)
 
     if converter_path is None:
@@ -104,9 +124,12 @@ def check_dependencies():
             logging.critical("Please install LibreOffice and ensure it is accessible from your PATH,")
             logging.critical("or update the CONVERTER_COMMAND variable in the script.")
             logging.critical("Installation instructions: https://www.libreoffice.org/download/download/")
+            _DEPENDENCIES_OK = False
             return False
 
+    CONVERTER_COMMAND = converter_path
     logging.info(f"Using converter: {CONVERTER_COMMAND}")
+    _DEPENDENCIES_OK = True
     return True
 
 def convert_emf_data_to_png_file(emf_base64_data, output_png_path, section_key_for_error_msg):
@@ -155,32 +178,37 @@ def convert_emf_data_to_png_file(emf_base64_data, output_png_path, section_key_f
                 '--outdir', temp_out_dir,
                 temp_emf_path
             ]
+            if LIBREOFFICE_PROFILE_DIR:
+                cmd.insert(1, f"-env:UserInstallation={pathlib.Path(LIBREOFFICE_PROFILE_DIR).absolute().as_uri()}")
             logging.debug(f"    Running conversion: {' '.join(cmd)}")
-            result_info = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=30) # Added timeout
+            # Output is kept as bytes and only decoded if it gets logged (on failure)
+            result_info = subprocess.run(cmd, capture_output=True, check=False, timeout=30) # Added timeout
 
             # Check if the expected output file was created and is valid
             if os.path.exists(expected_png_fullpath_in_temp) and os.path.getsize(expected_png_fullpath_in_temp) > 0:
                 try:
-                    # Ensure output dir for final PNG exists
-                    os.makedirs(os.path.dirname(output_png_path), exist_ok=True)
-                    # Move first to ensure it's safe before reading/cropping
-                    shutil.move(expected_png_fullpath_in_temp, output_png_path)
-                    logging.info(f"    Successfully converted and saved intermediate PNG to {os.path.basename(output_png_path)}")
-
+                    # Crop and encode the private temp copy, then move it into the
+                    # image directory: concurrent pipeline workers processing Acts
+                    # in the same directory can write PNGs with the same name there.
                     # --- Crop whitespace ---
                     logging.debug(f"      Attempting to crop whitespace from {os.path.basename(output_png_path)}...")
-                    crop_whitespace(output_png_path)
+                    crop_whitespace(expected_png_fullpath_in_temp)
                     # --- End cropping step ---
 
                     # --- Read FINAL (cropped) PNG and encode to Base64 ---
                     logging.debug(f"      Reading final PNG and encoding to Base64...")
-                    with open(output_png_path, 'rb') as png_file:
+                    with open(expected_png_fullpath_in_temp, 'rb') as png_file:
                         png_binary_data = png_file.read()
                     base64_encoded_string = base64.b64encode(png_binary_data).decode('utf-8')
                     base64_data_uri = f"data:image/png;base64,{base64_encoded_string}"
                     logging.debug(f"      Generated Base64 Data URI (length: {len(base64_data_uri)}).")
                     # --- End Base64 encoding ---
 
+                    # Ensure output dir for final PNG exists
+                    os.makedirs(os.path.dirname(output_png_path), exist_ok=True)
+                    shutil.move(expected_png_fullpath_in_temp, output_png_path)
+                    logging.info(f"    Successfully converted and saved intermediate PNG to {os.path.basename(output_png_path)}")
+
                     # --- Optional: Clean up the intermediate PNG file ---
                     # try:
                     #     os.remove(output_png_path)
@@ -203,9 +231,9 @@ def convert_emf_data_to_png_file(emf_base64_data, output_png_path, section_key_f
                 if retry_count >= MAX_RETRIES:
                     logging.error(f"  Image processing failed after {MAX_RETRIES + 1} attempts for image in section '{section_key_for_error_msg}':")
                     if result_info and result_info.stderr:
-                        logging.error(f"  LibreOffice Stderr: {result_info.stderr.strip()}")
+                        logging.error(f"  LibreOffice Stderr: {result_info.stderr.decode(errors='replace').strip()}")
                     if result_info and result_info.stdout:
-                        logging.error(f"  LibreOffice Stdout: {result_info.stdout.strip()}")
+                        logging.error(f"  LibreOffice Stdout: {result_info.stdout.decode(errors='replace').strip()}")
                     if not os.path.exists(expected_png_fullpath_in_temp):
                         logging.error(f"  Reason: Output file was not created in temp dir ({expected_png_fullpath_in_temp}).")
                     elif os.path.getsize(expected_png_fullpath_in_temp) == 0:
@@ -240,50 +268,30 @@ def convert_emf_data_to_png_file(emf_base64_data, output_png_path, section_key_f
 
     return base64_data_uri # Return URI string or None
 
-def process_json_images(input_json_filepath, output_json_filepath):
+def transform_dict(output_data, image_output_dir_abs):
     """
-    Loads the input JSON, processes HTML content to convert EMF/WMF images
-    to PNG data URIs, updates the HTML snippets, and saves the result
-    to the output JSON file.
+    Converts EMF/WMF images in each section's HTML to PNG data URIs.
+    Sections are updated in place (only their 'html' values are replaced);
+    intermediate PNGs are saved under image_output_dir_abs.
+    Returns the updated dictionary, or None if the image directory could not
+    be created.
     """
-    logging.info("--- Starting Metafile Image Conversion to Base64 ---")
-    logging.info(f"Loading data from {input_json_filepath}...")
-    try:
-        with open(input_json_filepath, 'r', encoding='utf-8') as f:
-            processed_data = json.load(f)
-    except FileNotFoundError:
-        logging.critical(f"Input file not found at {input_json_filepath}")
-        return False
-    except json.JSONDecodeError as e:
-        logging.critical(f"Error decoding JSON from {input_json_filepath}: {e}")
-        return False
-    except Exception as e:
-        logging.critical(f"Error reading input file {input_json_filepath}: {e}")
-        return False
-
-    # Determine the base directory for SAVING INTERMEDIATE PNGs
-    output_base_dir = os.path.dirname(output_json_filepath) or '.'
-    image_output_dir_abs = os.path.join(output_base_dir, DEFAULT_OUTPUT_IMAGE_SUBDIR)
-
     # Ensure the output directory for INTERMEDIATE images exists
     try:
         os.makedirs(image_output_dir_abs, exist_ok=True)
         logging.info(f"Ensured intermediate image output directory exists: '{image_output_dir_abs}'")
     except OSError as e:
         logging.error(f"Error creating intermediate image directory '{image_output_dir_abs}': {e}")
-        return False
+        return None
 
-    total_sections = len(processed_data)
+    total_sections = len(output_data)
     logging.info(f"Found {total_sections} sections to process.")
 
     processed_count = 0
     converted_images = 0
     conversion_errors = 0
 
-    # Create a deep copy to modify, avoiding issues with iterating and modifying
-    output_data = copy.deepcopy(processed_data)
-
-    for section_key, section_data in output_data.items(): # Iterate over the copy
+    for section_key, section_data in output_data.items():
         processed_count += 1
         if processed_count % 50 == 0 or processed_count == total_sections:
              logging.info(f"Processing section {processed_count}/{total_sections} ('{section_key}')...")
@@ -295,6 +303,9 @@ def process_json_images(input_json_filepath, output_json_filepath):
         html_content = section_data.get('html', '')
         if not html_content:
             continue
+        # Most sections have no metafile images; skip building a soup for them
+        if not any(prefix in html_content for prefix in METAFILE_SRC_PREFIXES):
+            continue
 
         try:
             soup = BeautifulSoup(html_content, 'html.parser')
@@ -303,7 +314,7 @@ def process_json_images(input_json_filepath, output_json_filepath):
 
             for img_tag in soup.find_all('img'):
                 src = img_tag.get('src', '')
-                if src.startswith(('data:image/x-emf;base64,', 'data:image/x-wmf;base64,')):
+                if src.startswith(METAFILE_SRC_PREFIXES):
                     logging.debug(f"  Found Metafile image (EMF/WMF) {img_index} in section '{section_key}'. Attempting conversion...")
                     emf_base64 = src.split(',', 1)[1]
 
@@ -343,10 +354,39 @@ def process_json_images(input_json_filepath, output_json_filepath):
     if conversion_errors > 0:
         logging.warning(f"Total image conversion errors: {conversion_errors}")
 
+    return output_data
+
+def process_json_images(input_json_filepath, output_json_filepath):
+    """
+    Loads the input JSON, processes HTML content to convert EMF/WMF images
+    to PNG data URIs, updates the HTML snippets, and saves the result
+    to the output JSON file.
+    """
+    logging.info("--- Starting Metafile Image Conversion to Base64 ---")
+    logging.info(f"Loading data from {input_json_filepath}...")
+    try:
+        processed_data = json_utils.load_file(input_json_filepath)
+    except FileNotFoundError:
+        logging.critical(f"Input file not found at {input_json_filepath}")
+        return False
+    except json.JSONDecodeError as e:
+        logging.critical(f"Error decoding JSON from {input_json_filepath}: {e}")
+        return False
+    except Exception as e:
+        logging.critical(f"Error reading input file {input_json_filepath}: {e}")
+        return False
+
+    # Determine the base directory for SAVING INTERMEDIATE PNGs
+    output_base_dir = os.path.dirname(output_json_filepath) or '.'
+    image_output_dir_abs = os.path.join(output_base_dir, DEFAULT_OUTPUT_IMAGE_SUBDIR)
+
+    output_data = transform_dict(processed_data, image_output_dir_abs)
+    if output_data is None:
+        return False
+
     logging.info(f"Saving updated data to {output_json_filepath}...")
     try:
-        with open(output_json_filepath, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=4, ensure_ascii=False) # Save the modified copy
+        json_utils.dump_file(output_data, output_json_filepath) # Save the updated data
         logging.info("Successfully saved updated data.")
         logging.info("--- Finished Metafile Image Conversion (successfully) ---")
         return True
@@ -1,9 +1,9 @@
 import json
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import time # Optional: for timing the process
 import sys # Import sys for command-line arguments
 import os # Import os for path operations
+import json_utils
 
 # --- Configuration (Defaults/Constants) ---
 # INPUT_JSON_FILE = 'sections_mammoth_html.json' # Replaced by sys.argv
@@ -14,11 +14,27 @@ MODEL_NAME = 'BAAI/bge-large-en-v1.5'
 BATCH_SIZE = 32
 # --- Configuration End ---
 
+_MODEL = None
+
+def get_model():
+    """Returns the embedding model, loading it on first use.
+
+    The model is kept for the life of the process, so in-process callers
+    that embed several documents only load it once. sentence_transformers
+    (and torch) are imported here so that importing this module stays cheap.
+    """
+    global _MODEL
+    if _MODEL is None:
+        from sentence_transformers import SentenceTransformer
+        print(f"Loading embedding model: {MODEL_NAME}...")
+        _MODEL = SentenceTransformer(MODEL_NAME)
+        print("Model loaded successfully.")
+    return _MODEL
+
 def load_json_data(filepath):
     """Loads data from a JSON file."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = json_utils.load_file(filepath)
         print(f"Successfully loaded data from {filepath}")
         return data
     except FileNotFoundError:
@@ -34,26 +50,21 @@ def load_json_data(filepath):
 def save_json_data(data, filepath):
     """Saves data to a JSON file."""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            # Use numpy encoder to handle potential numpy types if needed,
-            # though we convert embeddings to lists manually below.
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        # numpy embedding arrays are serialized natively (no .tolist() needed)
+        json_utils.dump_file(data, filepath)
         print(f"Successfully saved data with embeddings to {filepath}")
     except Exception as e:
         print(f"Error saving data to JSON: {e}")
 
-def main(input_filepath, output_filepath):
-    print("--- Starting Embedding Creation ---") # Added start marker
-    # Load the data
-    sections_data = load_json_data(input_filepath)
-    if not sections_data or not isinstance(sections_data, dict):
-        print("Exiting due to issues loading or validating input JSON data.")
-        sys.exit(1) # Exit if loading fails
+def embed_sections(sections_data):
+    """Adds an 'embedding' (numpy row) to each section with usable text.
 
+    Modifies sections_data in place and returns the number of sections
+    embedded. Raises if the model cannot be loaded.
+    """
     # Prepare texts and corresponding keys for embedding
     keys_list = []
     texts_to_embed = []
-    valid_section_count = 0
     for key, section_info in sections_data.items():
         if isinstance(section_info, dict) and 'text_for_embedding' in section_info:
             text = section_info['text_for_embedding']
@@ -61,28 +72,17 @@ def main(input_filepath, output_filepath):
             if isinstance(text, str) and text.strip():
                 keys_list.append(key)
                 texts_to_embed.append(text)
-                valid_section_count += 1
             else:
                  print(f"Warning: Skipping section '{key}' due to missing, empty, or non-string 'text_for_embedding'.")
         else:
             print(f"Warning: Skipping section '{key}' due to unexpected format or missing 'text_for_embedding'.")
 
     if not texts_to_embed:
-        print("No valid texts found to embed. Saving original data (or empty if none loaded).")
-        # Optionally save the original (potentially filtered) data back or just exit
-        save_json_data(sections_data, output_filepath) # Save even if no embeddings generated
-        sys.exit(0) # Exit successfully, as no work needed
+        print("No valid texts found to embed.")
+        return 0
 
-    print(f"Found {valid_section_count} sections with valid text to embed.")
-
-    # Load the embedding model
-    print(f"Loading embedding model: {MODEL_NAME}...")
-    try:
-        model = SentenceTransformer(MODEL_NAME)
-        print("Model loaded successfully.")
-    except Exception as e:
-        print(f"Error loading SentenceTransformer model: {e}")
-        sys.exit(1) # Exit if model loading fails
+    print(f"Found {len(texts_to_embed)} sections with valid text to embed.")
+    model = get_model()
 
     # Generate embeddings in batches
     print(f"Generating embeddings for {len(texts_to_embed)} texts (batch size: {BATCH_SIZE})...")
@@ -90,7 +90,8 @@ def main(input_filepath, output_filepath):
     all_embeddings = model.encode(
         texts_to_embed,
         batch_size=BATCH_SIZE,
-        show_progress_bar=True # Shows a progress bar during encoding
+        normalize_embeddings=True, # Unit vectors: inner-product search ranks the same as cosine
+        show_progress_bar=sys.stderr.isatty() # Progress bar only on a terminal; its redraws flood piped logs
     )
     end_time = time.time()
     print(f"Embeddings generated in {end_time - start_time:.2f} seconds.")
@@ -98,10 +99,27 @@ def main(input_filepath, output_filepath):
     # Add embeddings back to the original data structure
     print("Adding embeddings to the data structure...")
     for i, key in enumerate(keys_list):
-        # Convert numpy array to list for JSON serialization
-        sections_data[key]['embedding'] = all_embeddings[i].tolist()
+        # Keep the numpy row; json_utils serializes it directly as a float array
+        sections_data[key]['embedding'] = all_embeddings[i]
+    return len(keys_list)
+
+def main(input_filepath, output_filepath):
+    print("--- Starting Embedding Creation ---") # Added start marker
+    # Load the data
+    sections_data = load_json_data(input_filepath)
+    if not sections_data or not isinstance(sections_data, dict):
+        print("Exiting due to issues loading or validating input JSON data.")
+        sys.exit(1) # Exit if loading fails
+
+    try:
+        embedded_count = embed_sections(sections_data)
+    except Exception as e:
+        print(f"Error loading SentenceTransformer model or generating embeddings: {e}")
+        sys.exit(1) # Exit if model loading fails
 
-    # Save the updated data
+    if not embedded_count:
+        print("Saving original data (or empty if none loaded).")
+    # Save the updated data (even if no embeddings were generated)
     save_json_data(sections_data, output_filepath)
     print("--- Finished Embedding Creation --- N") # Added end marker
 
@@ -4,13 +4,38 @@ import os
 import json
 from bs4 import BeautifulSoup
 
-def convert_docx_to_html(docx_path, output_path=None):
+def docx_to_html_string(docx_path):
+    """
+    Converts a DOCX file to HTML using mammoth, without writing anything to disk.
+
+    Returns:
+        tuple: (html string, list of mammoth conversion messages)
+    """
+    with open(docx_path, 'rb') as docx_file:
+        result = mammoth.convert_to_html(docx_file)
+    return result.value, result.messages
+
+def prepare_html_for_images(html_content):
+    """
+    Prepares an HTML string for image conversion.
+    This function can be used to modify the HTML structure if needed.
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Add any necessary HTML processing here
+    # For example, you might want to add classes or modify image tags
+
+    return str(soup)
+
+def convert_docx_to_html(docx_path, output_path=None, process_for_images=False):
     """
     Converts a DOCX file to HTML using mammoth.
     
     Args:
         docx_path (str): Path to the input DOCX file
         output_path (str, optional): Path to save the HTML output. If None, uses the same name as input with .html extension
+        process_for_images (bool): Apply prepare_html_for_images() before the HTML is written,
+            so the file is written once instead of being re-read and re-written
     
     Returns:
         str: Path to the generated HTML file
@@ -24,10 +49,9 @@ def convert_docx_to_html(docx_path, output_path=None):
 
     try:
         # Convert DOCX to HTML
-        with open(docx_path, 'rb') as docx_file:
-            result = mammoth.convert_to_html(docx_file)
-            html = result.value
-            messages = result.messages
+        html, messages = docx_to_html_string(docx_path)
+        if process_for_images:
+            html = prepare_html_for_images(html)
 
         # Save the HTML output
         with open(output_path, 'w', encoding='utf-8') as html_file:
@@ -59,12 +83,7 @@ def process_html_for_images(html_path):
         with open(html_path, 'r', encoding='utf-8') as f:
             html_content = f.read()
 
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Add any necessary HTML processing here
-        # For example, you might want to add classes or modify image tags
-        
-        processed_html = str(soup)
+        processed_html = prepare_html_for_images(html_content)
         
         # Save the processed HTML
         with open(html_path, 'w', encoding='utf-8') as f:
@@ -84,6 +103,4 @@ if __name__ == "__main__":
     input_docx = sys.argv[1]
     output_html = sys.argv[2] if len(sys.argv) > 2 else None
 
-    html_path = convert_docx_to_html(input_docx, output_html)
-    if html_path:
-        process_html_for_images(html_path) 
\ No newline at end of file
+    convert_docx_to_html(input_docx, output_html, process_for_images=True) 
\ No newline at end of file
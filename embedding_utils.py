@@ -0,0 +1,35 @@
+# embedding_utils.py
+"""
+Embedding model loaders shared by semantic_search.py and the search UI.
+
+sentence_transformers (and torch) are only imported when a model is loaded,
+so importing this module stays cheap.
+"""
+import os
+
+# Dynamically quantized (int8) graph written by export_dynamic_quantized_onnx_model()
+QUANTIZED_ONNX_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+def load_quantized_onnx_model(model_name, model_path):
+    """Loads the model as an int8 ONNX Runtime graph, exporting it on first use.
+
+    The exported FP32 graph and its dynamically quantized copy are saved under
+    model_path. Tokenization, pooling and normalization still come from the
+    SentenceTransformer wrapper, so embeddings stay comparable with the FP32
+    vectors already stored in Supabase.
+    """
+    from sentence_transformers import SentenceTransformer
+    if not os.path.isfile(os.path.join(model_path, QUANTIZED_ONNX_FILE)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        print(f"Exporting quantized ONNX model to {model_path} (one-time)...")
+        onnx_model = SentenceTransformer(model_name, device='cpu', backend='onnx')
+        onnx_model.save(model_path)
+        export_dynamic_quantized_onnx_model(onnx_model, 'avx512_vnni', model_path)
+    return SentenceTransformer(
+        model_path,
+        device='cpu',
+        backend='onnx',
+        local_files_only=True,
+        model_kwargs={'file_name': QUANTIZED_ONNX_FILE}
+    )
@@ -1,34 +1,69 @@
 import json
 from bs4 import BeautifulSoup, NavigableString
+from lxml import html as lxml_html
 import re
 import sys # Import sys to access command-line arguments
 import os # Import os for path operations (optional but good practice)
 import logging # Import the logging module
+import json_utils
 
 # --- Logging Setup ---
 # Basic configuration will be done in the main block
 # --- End Logging Setup ---
 
+# --- Compiled Patterns (built once at import, reused for every tag) ---
+# Explicitly list hyphen/dash characters to replace, excluding em-dash (U+2014) etc.
+# Includes: U+2010, U+2011, U+2012, U+2013, U+002D
+_HYPHENS_RE = re.compile(r'[\u2010\u2011\u2012\u2013\-]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Trailing page number at the end of a heading's last element (ToC style)
+_TRAILING_PAGE_NUMBER_RE = re.compile(r'\s+\d+\s*(?=</[^>]+>\s*$)')
+
+# Structure marker patterns, tried in this order.
+# Group 1: ID (standard hyphen '-')
+# Group 2: Heading Text
+# Separator after ID is handled by consuming non-alphanumeric/space characters
+# Heading capture stops before optional trailing number
+STRUCTURE_PATTERNS = {
+    'Chapter':     re.compile(r"^\s*Chapter[\s\u00A0]+(\d{1,3}[A-Z]?)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
+    'Part':        re.compile(r"^\s*Part[\s\u00A0]+(\d{1,3}[A-Z]?-\d{1,3}[A-Z]?)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
+    'Division':    re.compile(r"^\s*Division[\s\u00A0]+(\d{1,3}[A-Z]?)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
+    'Subdivision': re.compile(r"^\s*Subdivision[\s\u00A0]+(\d{1,3}[A-Z]?-[A-Z]+)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
+    # Guide pattern uses whitespace separator explicitly before heading
+    'Guide':       re.compile(r"^\s*Guide to (Division|Subdivision|Part|Chapter)[\s\u00A0]+(\d{1,3}[A-Z]?(?:-\d{1,3}[A-Z]?|-[A-Z])?)[\s\u00A0]+(.*?)(?:\s+\d+)?$", re.IGNORECASE),
+    # Section pattern adjusted
+    'Section':     re.compile(r"^\s*(?:<strong>)?(\d{1,3}[A-Z]?-\d{1,3}[A-Z]?)(?:</strong>)?(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE)
+}
+# Capture group holding each level's ID and heading text ('Guide' has the guide type in group 1)
+ID_GROUP_INDEX = {level: 1 for level in STRUCTURE_PATTERNS} | {'Guide': 2}
+HEADING_GROUP_INDEX = {level: 2 for level in STRUCTURE_PATTERNS} | {'Guide': 3}
+# Known non-structural headers (compared lower-cased)
+IGNORED_HEADER_TEXTS = frozenset(["operative provisions", "table of sections"])
+# --- End Compiled Patterns ---
+
+# libxml2 silently empties text and attribute values over 10 MB (e.g. large
+# base64 data: URI images) unless huge_tree is set. BeautifulSoup's lxml
+# builder can't set it, so documents that large are parsed with html.parser.
+_HTML_PARSER = lxml_html.HTMLParser(huge_tree=True)
+LXML_VALUE_LIMIT = 10_000_000
+
 def normalize_hyphens(text):
     """Replaces various Unicode dashes/hyphens with standard hyphen-minus."""
     if not text:
         return text
-    # Explicitly list hyphen/dash characters to replace, excluding em-dash (U+2014) etc.
-    # Includes: U+2010, U+2011, U+2012, U+2013, U+002D
-    return re.sub(r'[\u2010\u2011\u2012\u2013\-]+', '-', text)
+    return _HYPHENS_RE.sub('-', text)
 
 def clean_html_for_embedding(html_string):
     """Removes images and extracts clean text from an HTML string."""
     if not html_string:
         return ""
-    soup = BeautifulSoup(html_string, 'html.parser')
-    
-    # Remove all image tags
-    for img_tag in soup.find_all('img'):
-        img_tag.decompose() # Or img_tag.extract()
-        
+    # Walk the lxml tree directly (in C) rather than building a BeautifulSoup
+    # copy; images carry no text, so they drop out without removing the tags.
+    root = lxml_html.fragment_fromstring(html_string, create_parent='div', parser=_HTML_PARSER)
+
     # Extract text, using space as separator, and strip whitespace
-    text = soup.get_text(separator=' ', strip=True)
+    stripped = (fragment.strip() for fragment in root.itertext())
+    text = ' '.join(fragment for fragment in stripped if fragment)
     return text
 
 def extract_html_sections(html_content):
@@ -46,9 +81,11 @@ def extract_html_sections(html_content):
     """
     if not html_content:
         logging.error("No HTML content provided to extract_html_sections.") 
-        return {}
+        return {}, []
 
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # No single value can reach the lxml limit unless the whole document does
+    # (the large values are base64 data: URIs, where characters = bytes)
+    soup = BeautifulSoup(html_content, 'lxml' if len(html_content) < LXML_VALUE_LIMIT else 'html.parser')
     sections_dict = {}
     ordered_keys = [] # Keep track of the order sections are definitively identified
 
@@ -67,30 +104,9 @@ def extract_html_sections(html_content):
     current_html_snippet_tags = []  # Accumulates tags for the current section
     found_first_section = False     # Flag to start accumulating content only after first heading
 
-    # Define specific separators
-    whitespace_separator = r"[\s\u00A0]+" # Match standard whitespace AND non-breaking space (U+00A0)
-    # Separator allowing whitespace OR common dashes (incl em-dash) AFTER an ID
-    id_heading_separator_pattern = r"[\s\u2010-\u2015\-]+"
-    # Standard hyphen is still needed for splitting IDs later
+    # Standard hyphen is needed for splitting IDs later
     standard_hyphen = "-"
 
-    # --- Patterns using refined separators ---
-    # Group 1: ID (standard hyphen '-')
-    # Group 2: Heading Text
-    # Separator after ID is handled by consuming non-alphanumeric/space characters
-    # Heading capture stops before optional trailing number
-    patterns = {
-        'Chapter':     re.compile(r"^\s*Chapter[\s\u00A0]+(\d{1,3}[A-Z]?)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
-        'Part':        re.compile(r"^\s*Part[\s\u00A0]+(\d{1,3}[A-Z]?-\d{1,3}[A-Z]?)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
-        'Division':    re.compile(r"^\s*Division[\s\u00A0]+(\d{1,3}[A-Z]?)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
-        'Subdivision': re.compile(r"^\s*Subdivision[\s\u00A0]+(\d{1,3}[A-Z]?-[A-Z]+)(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE),
-        # Guide pattern uses whitespace separator explicitly before heading
-        'Guide':       re.compile(r"^\s*Guide to (Division|Subdivision|Part|Chapter)[\s\u00A0]+(\d{1,3}[A-Z]?(?:-\d{1,3}[A-Z]?|-[A-Z])?)[\s\u00A0]+(.*?)(?:\s+\d+)?$", re.IGNORECASE),
-        # Section pattern adjusted
-        'Section':     re.compile(r"^\s*(?:<strong>)?(\d{1,3}[A-Z]?-\d{1,3}[A-Z]?)(?:</strong>)?(?:[^\w\s]|\s)*(.*?)(?:\s+\d+)?$", re.IGNORECASE)
-    }
-    # --- End Patterns ---
-
     # --- Main Loop ---
     for tag_index, tag in enumerate(content_tags):
         # --- Process current tag ---
@@ -108,8 +124,7 @@ def extract_html_sections(html_content):
         logging.debug(f"  Normalized Text: '{normalized_text}'")
 
         # --- Explicitly ignore known non-section headers --- 
-        ignore_texts = ["operative provisions", "table of sections"]
-        is_ignored_header = normalized_text.lower() in ignore_texts
+        is_ignored_header = normalized_text.lower() in IGNORED_HEADER_TEXTS
         if is_ignored_header:
             logging.debug(f"  Ignoring known non-structural header: '{normalized_text}'")
             # Append to current section if active, otherwise skip
@@ -124,7 +139,7 @@ def extract_html_sections(html_content):
         heading_text = ""
         if normalized_text: 
             logging.debug("  Checking patterns against NORMALIZED text...")
-            for level, pattern in patterns.items():
+            for level, pattern in STRUCTURE_PATTERNS.items():
                 current_match = pattern.match(normalized_text)
                 match_result = "MATCH" if current_match else "NO MATCH"
                 logging.debug(f"    Pattern '{level}': {match_result}")
@@ -133,9 +148,9 @@ def extract_html_sections(html_content):
                     match_obj = current_match 
                     logging.debug(f"  >>> Matched as '{matched_level}'")
                     try:
-                        group_index = 3 if level == 'Guide' else 2
+                        group_index = HEADING_GROUP_INDEX[level]
                         extracted_heading = match_obj.group(group_index).strip() if match_obj.group(group_index) else ""
-                        heading_text = re.sub(r'\s+', ' ', extracted_heading).strip()
+                        heading_text = _WHITESPACE_RE.sub(' ', extracted_heading).strip()
                         logging.debug(f"    Extracted heading: '{heading_text}'")
                     except IndexError:
                         heading_text = ""
@@ -170,23 +185,24 @@ def extract_html_sections(html_content):
                 new_key = None
                 guide_type = None
                 try:
-                    id_group_index = 2 if matched_level == 'Guide' else 1
+                    id_group_index = ID_GROUP_INDEX[matched_level]
                     raw_identifier = match_obj.group(id_group_index)
                 except IndexError:
                     logging.error(f"Regex error: Could not extract ID group {id_group_index} for level '{matched_level}' from text: {normalized_text}")
                     raw_identifier = None
                 
+                # Match groups come from normalized_text, so IDs already use the
+                # standard hyphen and need no further normalize_hyphens() pass.
                 if raw_identifier:
                     if matched_level == 'Guide':
                        try: 
                            guide_type = match_obj.group(1)
-                           raw_key_str = f"Guide to {guide_type} {raw_identifier}"
-                           new_key = normalize_hyphens(raw_key_str)
+                           new_key = f"Guide to {guide_type} {raw_identifier}"
                        except IndexError:
                            logging.error(f"Could not extract guide type (group 1) for Guide match: {normalized_text}")
                            new_key = None
                     else:
-                        new_key = normalize_hyphens(f"{matched_level}-{raw_identifier}")
+                        new_key = f"{matched_level}-{raw_identifier}"
                 else:
                     logging.warning(f"Could not extract identifier for matched level '{matched_level}' in text: {normalized_text[:100]}...")
                     new_key = None
@@ -195,19 +211,21 @@ def extract_html_sections(html_content):
                 if new_key:
                     section_info = {"structure_type": matched_level, "heading_text": heading_text}
                     # Add IDs, guide_type etc.
-                    normalized_identifier = normalize_hyphens(raw_identifier)
-                    section_info["full_id"] = normalized_identifier
-                    id_parts = normalized_identifier.split(standard_hyphen)
+                    section_info["full_id"] = raw_identifier
+                    id_parts = raw_identifier.split(standard_hyphen)
                     if len(id_parts) > 0: section_info["primary_id"] = id_parts[0]
                     if len(id_parts) > 1: section_info["secondary_id"] = id_parts[1]
                     if matched_level == 'Guide' and guide_type: section_info["guide_target_type"] = guide_type
 
                     logging.debug(f"  >>> Starting new definitive section: Key='{new_key}', Info={section_info}")
-                    if new_key in sections_dict:
+                    # Keys enter sections_dict and ordered_keys together, so the dict
+                    # answers "seen before?" without scanning the ordered list
+                    is_new_key = new_key not in sections_dict
+                    if not is_new_key:
                         logging.warning(f"Duplicate key (definitive heading): '{new_key}'. Overwriting.")
                     sections_dict[new_key] = section_info # Set metadata
                     # Add key to ordered list if it's the first time we see this definitive key
-                    if new_key not in ordered_keys:
+                    if is_new_key:
                         ordered_keys.append(new_key)
                     current_key = new_key # Update active section key
                     current_html_snippet_tags = [tag] # Start new snippet list with heading tag
@@ -294,7 +312,7 @@ def build_final_content(sections_dict, ordered_keys):
             
             # 2. Clean its HTML and add it to the context for subsequent sections
             if current_html:
-                 cleaned_html = re.sub(r'\s+\d+\s*(?=</[^>]+>\s*$)', '', current_html.strip())
+                 cleaned_html = _TRAILING_PAGE_NUMBER_RE.sub('', current_html.strip())
                  current_context_html += cleaned_html + "\n"
                  logging.debug(f"    Added HTML from '{key}' to context.")
             
@@ -324,11 +342,29 @@ def build_final_content(sections_dict, ordered_keys):
     logging.info(f"Finished building final content. Final dictionary has {len(final_dict)} entries.")
     return final_dict
 
+def transform_html(html_content):
+    """
+    Runs the full parsing stage on a mammoth HTML string: section extraction,
+    table-of-sections post-processing and the final content build.
+    Returns the final sections dictionary (empty if nothing was identified).
+    """
+    logging.info("Starting HTML section extraction...")
+    sections, ordered_keys = extract_html_sections(html_content) # Get both dict and ordered keys
+
+    # Perform Post-Processing Steps
+    if sections and ordered_keys: # Ensure we have data to process
+        # 1. Process Tables of Sections first (modifies sections dict in-place)
+        processed_sections = post_process_table_of_sections(sections, ordered_keys)
+        # 2. Build the final content structure (copies originals, builds new sections)
+        return build_final_content(processed_sections, ordered_keys)
+
+    logging.warning("Skipping post-processing as no sections or ordered keys were generated.")
+    return sections # Return original if no processing happened
+
 def save_to_json(data, json_filepath):
     """Saves the dictionary to a JSON file."""
     try:
-        with open(json_filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        json_utils.dump_file(data, json_filepath)
         logging.info(f"Successfully saved data to {json_filepath}") 
     except Exception as e:
         logging.error(f"Error saving data to JSON: {e}") 
@@ -353,47 +389,42 @@ if __name__ == "__main__":
     # Read input and output paths from command-line arguments
     if len(sys.argv) != 3:
         # Use logging for critical errors before exiting
-        logging.critical(f"Usage: python {os.path.basename(__file__)} <input_mammoth_json> <output_parsed_json>") 
+        logging.critical(f"Usage: python {os.path.basename(__file__)} <input_mammoth_html_or_json> <output_parsed_json>")
         sys.exit(1)
 
-    input_json_path = sys.argv[1]
+    input_path = sys.argv[1]
     output_json_path = sys.argv[2]
 
-    # Load the HTML content from the input JSON file
+    # Load the HTML content. Raw mammoth .html is read as-is; a .json input is
+    # expected to wrap the HTML as {"html_content": ...} (legacy intermediate).
     html_to_parse = None
+    is_json_input = input_path.lower().endswith('.json')
     try:
-        logging.info(f"Loading HTML from: {input_json_path}") # Log info
-        with open(input_json_path, 'r', encoding='utf-8') as f_in:
-            data = json.load(f_in)
+        logging.info(f"Loading HTML from: {input_path}") # Log info
+        if is_json_input:
+            # Only 'html_content' is needed, so parse lazily where supported
+            data = json_utils.load_file_lazy(input_path)
             if "html_content" in data:
                 html_to_parse = data["html_content"]
             else:
                 # Use logging for critical errors
-                logging.critical(f"Input JSON '{input_json_path}' does not contain 'html_content' key.") 
+                logging.critical(f"Input JSON '{input_path}' does not contain 'html_content' key.")
                 sys.exit(1)
+        else:
+            with open(input_path, 'r', encoding='utf-8') as f_in:
+                html_to_parse = f_in.read()
     except FileNotFoundError:
-        logging.critical(f"Input JSON file not found at '{input_json_path}'") 
+        logging.critical(f"Input file not found at '{input_path}'")
         sys.exit(1)
     except json.JSONDecodeError:
-        logging.critical(f"Could not decode JSON from '{input_json_path}'") 
+        logging.critical(f"Could not decode JSON from '{input_path}'")
         sys.exit(1)
     except Exception as e:
-        logging.critical(f"Error reading input JSON file '{input_json_path}': {e}") 
+        logging.critical(f"Error reading input file '{input_path}': {e}")
         sys.exit(1)
 
     # Process the loaded HTML
-    logging.info("Starting HTML section extraction...")
-    sections, ordered_keys = extract_html_sections(html_to_parse) # Get both dict and ordered keys
-
-    # Perform Post-Processing Steps
-    if sections and ordered_keys: # Ensure we have data to process
-        # 1. Process Tables of Sections first (modifies sections dict in-place)
-        processed_sections = post_process_table_of_sections(sections, ordered_keys)
-        # 2. Build the final content structure (copies originals, builds new sections)
-        final_content = build_final_content(processed_sections, ordered_keys)
-    else:
-        logging.warning("Skipping post-processing as no sections or ordered keys were generated.")
-        final_content = sections # Assign original if no processing happened
+    final_content = transform_html(html_to_parse)
 
     # Save the final results to the specified output JSON path
     if final_content is not None: 
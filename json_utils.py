@@ -0,0 +1,125 @@
+# json_utils.py
+"""
+JSON helpers shared by the pipeline scripts.
+
+Uses orjson (Rust-backed, serializes numpy arrays natively) when it is
+installed and falls back to the standard library otherwise. Files are read
+and written as UTF-8 bytes in both cases. pysimdjson, when available, backs
+load_file_lazy() for readers that only touch a few keys of a large file, and
+ijson backs iter_file_items() for readers that go through a file one
+top-level entry at a time. format_pgvector() writes embeddings as pgvector
+literals for the database.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can keep
+# catching this single exception type regardless of the backend in use.
+JSONDecodeError = json.JSONDecodeError
+
+
+def _default(obj):
+    """Fallback serializer for the stdlib path (e.g. numpy arrays/scalars)."""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def loads(data):
+    """Parses JSON from a str or bytes object."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=False):
+    """Serializes obj to UTF-8 encoded JSON bytes.
+
+    Pipeline intermediates are machine-read, so output is compact unless
+    indent=True (2-space indentation, the only width orjson supports).
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def format_pgvector(vec):
+    """Returns vec (numpy array or list of floats) as a pgvector text literal.
+
+    The values are converted to float32, pgvector's storage type, and written
+    in one pass as '[x1,x2,...]': shortest float32 digits with orjson, 9
+    significant digits (also exact) without it. That is about half the size
+    of the float64 reprs a list of Python floats would be sent as.
+    """
+    import numpy as np # Only the embedding/search code needs numpy
+    vec = np.asarray(vec, dtype=np.float32) # No copy for float32 arrays (encode() output)
+    if orjson is not None:
+        return orjson.dumps(vec, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return '[' + ','.join([format(x, '.9g') for x in vec.tolist()]) + ']'
+
+
+def load_file(filepath):
+    """Loads and returns the JSON document stored at filepath."""
+    with open(filepath, 'rb') as f:
+        return loads(f.read())
+
+
+def load_file_lazy(filepath):
+    """Loads a JSON document for read-only access to a subset of its keys.
+
+    With pysimdjson installed this returns a lazy proxy: values are only
+    converted to Python objects when accessed (call .as_dict()/.as_list() on a
+    subtree to materialize it). Without it, falls back to load_file(). The
+    result must not be passed to dumps() directly.
+    """
+    if simdjson is None:
+        return load_file(filepath)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    try:
+        return simdjson.Parser().parse(data)
+    except ValueError as e:
+        # Surface parse errors as the same exception type as load_file()
+        raise JSONDecodeError(str(e), '', 0) from e
+
+
+def iter_file_items(filepath):
+    """Yields the (key, value) pairs of the JSON object stored at filepath.
+
+    With ijson installed the file is parsed incrementally, so only the
+    current value is held in memory (numbers come back as float/int, not
+    Decimal). Without it, the whole document is loaded by load_file() first.
+    Parse errors are raised as JSONDecodeError either way, possibly after
+    some pairs have been yielded.
+    """
+    if ijson is None:
+        yield from load_file(filepath).items()
+        return
+    with open(filepath, 'rb') as f:
+        try:
+            yield from ijson.kvitems(f, '', use_float=True)
+        except ijson.JSONError as e:
+            raise JSONDecodeError(str(e), '', 0) from e
+
+
+def dump_file(obj, filepath, indent=False):
+    """Writes obj as JSON to filepath."""
+    with open(filepath, 'wb') as f:
+        f.write(dumps(obj, indent=indent))
@@ -1,9 +1,14 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import Response
 from pydantic import BaseModel, Field # Use Field for potential examples/validation
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
 from sentence_transformers import SentenceTransformer
+import json_utils
+from style_html_content import SECTION_CSS
 import uvicorn
 from typing import List, Dict, Any, Optional
 
@@ -16,34 +21,48 @@ MODEL_NAME = os.getenv("EMBEDDING_MODEL", 'BAAI/bge-large-en-v1.5')
 try:
     print(f"Loading embedding model: {MODEL_NAME}...")
     embedding_model = SentenceTransformer(MODEL_NAME)
+    # Queries only: longer ones are truncated, bounding attention cost
+    embedding_model.max_seq_length = int(os.getenv("QUERY_MAX_SEQ_LEN", 128))
+    # One throwaway forward pass, so the first request doesn't pay for lazy initialization
+    embedding_model.encode(["warmup query"], normalize_embeddings=True)
     print("Embedding model loaded successfully.")
 except Exception as e:
     print(f"FATAL: Could not load embedding model: {e}")
     embedding_model = None # Ensure it's None if loading failed
 
 # --- Supabase Client Cache ---
+# The async client is created on startup (it must be awaited) so RPC calls
+# yield to the event loop instead of blocking it for a network round trip.
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-try:
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env")
-    print("Initializing Supabase client...")
-    supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("Supabase client initialized successfully.")
-except Exception as e:
-    print(f"FATAL: Could not initialize Supabase client: {e}")
-    supabase_client = None # Ensure it's None if init failed
+supabase_client: Optional[AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global supabase_client
+    try:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env")
+        print("Initializing Supabase client...")
+        supabase_client = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+        print("Supabase client initialized successfully.")
+    except Exception as e:
+        print(f"FATAL: Could not initialize Supabase client: {e}")
+        supabase_client = None # Ensure it's None if init failed
+    yield
 
 # --- API Configuration ---
-SEARCH_FUNCTION = os.getenv("SEARCH_FUNCTION", "match_sections")
+SEARCH_FUNCTION = os.getenv("SEARCH_FUNCTION", "match_sections") # match_sections_ip: inner product (see semantic_search.py)
 SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 5))
 MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", 0.5)) # Allow configuration
+SECTIONS_TABLE = "sections" # Read directly for html_content when the search RPC omits it
 
 # --- FastAPI App Instance ---
 app = FastAPI(
     title="Legislative Search API",
     description="API for performing semantic search on legislative document sections.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # --- Request & Response Models ---
@@ -58,13 +77,70 @@ class SearchResultItem(BaseModel):
     structure_type: str
     full_id: str
     text_content: str
-    html_content: str
+    html_content: Optional[str] = None # Filled by attach_html_content() when the RPC omits it
     heading_text: str
     similarity: float
 
 class SearchResponse(BaseModel):
     results: List[SearchResultItem]
 
+class BatchSearchQuery(BaseModel):
+    queries: List[str] = Field(..., example=["definition of resident for tax purposes", "meaning of income year"])
+    limit: Optional[int] = Field(SEARCH_LIMIT, example=5, description="Max number of results per query")
+    threshold: Optional[float] = Field(MATCH_THRESHOLD, example=0.5, description="Minimum similarity score")
+
+class BatchSearchResponse(BaseModel):
+    results: List[List[SearchResultItem]] # One result list per query, in request order
+
+# --- Supabase Search ---
+def embed_queries(queries: List[str]) -> List[str]:
+    """Encodes queries in one batch and returns their pgvector literals.
+
+    CPU-bound: the endpoints run it in a worker thread (asyncio.to_thread) so
+    the event loop keeps serving other requests' RPC round trips meanwhile.
+    """
+    return [json_utils.format_pgvector(row) for row in embedding_model.encode(queries, normalize_embeddings=True)]
+
+async def search_rpc(query_vector: str, match_threshold: float, match_count: int) -> List[Dict[str, Any]]:
+    """Runs the similarity search RPC for one query embedding and returns the matching rows."""
+    response = await supabase_client.rpc(
+        SEARCH_FUNCTION,
+        {
+            'query_embedding': query_vector,
+            'match_threshold': match_threshold,
+            'match_count': match_count
+        }
+    ).execute()
+
+    if hasattr(response, 'data') and response.data:
+        # Validate data structure slightly if needed, or rely on Supabase function correctness
+        # Pydantic will validate on return based on the response model
+        return await attach_html_content(response.data)
+    elif hasattr(response, 'error') and response.error:
+        print(f"Supabase RPC error: {response.error}")
+        raise HTTPException(status_code=500, detail=f"Database search error: {response.error.get('message', 'Unknown DB error')}")
+    return [] # No error, but no results found
+
+async def attach_html_content(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Adds html_content to ranked rows from an RPC that leaves it out.
+
+    Functions such as match_sections_ip return only the light columns, which
+    keeps the vector query's response small; the HTML for all of a query's
+    results is then read in one select keyed by section_key. Rows keep the
+    RPC's ranking order.
+    """
+    missing_keys = [row['section_key'] for row in rows if 'html_content' not in row]
+    if not missing_keys:
+        return rows
+    response = await supabase_client.table(SECTIONS_TABLE).select(
+        'section_key,html_content'
+    ).in_('section_key', missing_keys).execute()
+    html_by_key = {item['section_key']: item.get('html_content') for item in response.data or []}
+    for row in rows:
+        if 'html_content' not in row:
+            row['html_content'] = html_by_key.get(row['section_key'])
+    return rows
+
 # --- Health Check Endpoint ---
 @app.get("/health", tags=["Health"])
 async def health_check():
@@ -77,6 +153,16 @@ async def health_check():
     # Could add a simple Supabase ping here if needed
     return {"status": "ok"}
 
+# --- Section Stylesheet ---
+@app.get("/section.css", tags=["Sections"])
+async def section_stylesheet():
+    """Stylesheet for the heading/indent classes used in html_content.
+
+    Section HTML carries no <style> block of its own; include this once in
+    any page that renders sections.
+    """
+    return Response(content=SECTION_CSS, media_type="text/css")
+
 # --- Search Endpoint ---
 @app.post("/search", response_model=SearchResponse, tags=["Search"])
 async def search_sections(search_query: SearchQuery):
@@ -91,7 +177,7 @@ async def search_sections(search_query: SearchQuery):
 
     # 1. Generate Query Embedding
     try:
-        query_vector = embedding_model.encode(search_query.query).tolist()
+        query_vector = (await asyncio.to_thread(embed_queries, [search_query.query]))[0]
     except Exception as e:
         print(f"Error generating embedding: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate query embedding")
@@ -101,24 +187,7 @@ async def search_sections(search_query: SearchQuery):
         search_limit = search_query.limit if search_query.limit is not None else SEARCH_LIMIT
         match_threshold = search_query.threshold if search_query.threshold is not None else MATCH_THRESHOLD
 
-        response = supabase_client.rpc(
-            SEARCH_FUNCTION,
-            {
-                'query_embedding': query_vector,
-                'match_threshold': match_threshold,
-                'match_count': search_limit
-            }
-        ).execute()
-
-        if hasattr(response, 'data') and response.data:
-            # Validate data structure slightly if needed, or rely on Supabase function correctness
-            # Pydantic will validate on return based on SearchResponse model
-             return {"results": response.data}
-        elif hasattr(response, 'error') and response.error:
-            print(f"Supabase RPC error: {response.error}")
-            raise HTTPException(status_code=500, detail=f"Database search error: {response.error.get('message', 'Unknown DB error')}")
-        else:
-             return {"results": []} # No error, but no results found
+        return {"results": await search_rpc(query_vector, match_threshold, search_limit)}
 
     except HTTPException as http_exc:
          raise http_exc # Re-raise HTTP exceptions
@@ -126,6 +195,44 @@ async def search_sections(search_query: SearchQuery):
         print(f"Error during Supabase search RPC call: {e}")
         raise HTTPException(status_code=500, detail="An internal error occurred during search")
 
+# --- Batch Search Endpoint ---
+@app.post("/search/batch", response_model=BatchSearchResponse, tags=["Search"])
+async def search_sections_batch(batch_query: BatchSearchQuery):
+    """
+    Performs semantic search for several queries at once.
+    The queries are embedded in one batched encode call and their RPCs are
+    issued concurrently, so total latency is roughly one round trip rather than N.
+    """
+    if embedding_model is None:
+        raise HTTPException(status_code=503, detail="Embedding model not available")
+    if supabase_client is None:
+        raise HTTPException(status_code=503, detail="Supabase client not available")
+    if not batch_query.queries:
+        return {"results": []}
+
+    # 1. Generate Query Embeddings (single batched forward pass)
+    try:
+        query_vectors = await asyncio.to_thread(embed_queries, batch_query.queries)
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate query embeddings")
+
+    # 2. Search Supabase (one RPC per query, in flight together)
+    try:
+        search_limit = batch_query.limit if batch_query.limit is not None else SEARCH_LIMIT
+        match_threshold = batch_query.threshold if batch_query.threshold is not None else MATCH_THRESHOLD
+
+        results = await asyncio.gather(
+            *(search_rpc(query_vector, match_threshold, search_limit) for query_vector in query_vectors)
+        )
+        return {"results": results}
+
+    except HTTPException as http_exc:
+         raise http_exc # Re-raise HTTP exceptions
+    except Exception as e:
+        print(f"Error during Supabase batch search RPC calls: {e}")
+        raise HTTPException(status_code=500, detail="An internal error occurred during search")
+
 # --- Run Instruction (for local dev) ---
 if __name__ == "__main__":
     print("\n--- To run the API server: ---")
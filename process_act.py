@@ -1,12 +1,114 @@
 # process_act.py
 import argparse
+import contextlib
+import io
 import json
 import os
 import sys
-import subprocess
-import datetime # Keep for potential future use, though timestamp now in upload script
-from dotenv import load_dotenv # Needed for deletion step
-from supabase import create_client, Client # Needed for deletion step
+import logging
+import logging.handlers
+import multiprocessing
+import tempfile
+import re
+import datetime
+import json_utils
+import docx_to_html
+import html_parser
+import convert_emf_images
+import style_html_content
+import create_embeddings
+import upload_to_supabase
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Annotated, List, Optional
+from pydantic import BaseModel, StrictStr, StringConstraints, TypeAdapter, ValidationError, field_validator
+from supabase import Client
+
+# --- Configuration ---
+SUPABASE_TABLE_NAME = 'sections' # Consistent with upload script
+DELETE_BATCH_SIZE = 100 # Max act names per DELETE ... IN (...) request, keeps the URL short
+# Files processed concurrently (override with PIPELINE_WORKERS). Each worker
+# loads its own embedding model (~1.3 GB for bge-large), so the default is
+# kept small; the CPU threads torch may use are split between the workers.
+DEFAULT_PIPELINE_WORKERS = min(2, os.cpu_count() or 1)
+LOG_FILE = 'process_act.log'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+CONSOLE_LOG_FORMAT = '%(levelname)s - %(message)s'
+# --- Configuration End ---
+
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$') # compilation_date format (YYYY-MM-DD)
+
+class DocxEntry(BaseModel):
+    """One entry of the config's 'docx_files' list."""
+    path: StrictStr
+    act_name: Annotated[StrictStr, StringConstraints(strip_whitespace=True, min_length=1)]
+    compilation_date: datetime.date
+
+    @field_validator('path')
+    @classmethod
+    def _check_docx_extension(cls, value):
+        if not value.lower().endswith(".docx"):
+            raise ValueError("must be a .docx file")
+        return value
+
+    @field_validator('compilation_date', mode='before')
+    @classmethod
+    def _check_date_format(cls, value):
+        # Only YYYY-MM-DD strings; pydantic would also accept timestamps and datetimes
+        if not isinstance(value, str) or not _DATE_RE.fullmatch(value):
+            raise ValueError("use YYYY-MM-DD")
+        return value
+
+# Built once; validates the whole list and reports every invalid entry at once
+_DOCX_ENTRIES_ADAPTER = TypeAdapter(List[DocxEntry])
+
+_SUPABASE_CLIENT: Optional[Client] = None
+
+def _get_supabase():
+    """Returns the Supabase client shared by the deletion and upload steps.
+
+    Created on first use (loading .env once); None if credentials are missing.
+    """
+    global _SUPABASE_CLIENT
+    if _SUPABASE_CLIENT is None:
+        _SUPABASE_CLIENT = upload_to_supabase.create_supabase_client()
+    return _SUPABASE_CLIENT
+
+def _safe_unlink(path, *, warn_label="intermediate file"):
+    """Removes path if it exists. Returns True if a file was removed.
+
+    A missing file is not an error; any other OSError is reported as a warning.
+    """
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        print(f"  Warning: Could not remove {warn_label} {path}: {e}", file=sys.stderr)
+        return False
+
+def _find_missing_files(paths):
+    """Returns the paths that are not existing regular files.
+
+    Lists each parent directory once with os.scandir instead of stat-ing
+    every path individually. Names not found in the listing as written are
+    checked with os.path.isfile, so case-insensitive filesystems still
+    match e.g. 'Act.DOCX' to Act.docx.
+    """
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+    missing = []
+    for directory, dir_paths in by_dir.items():
+        try:
+            with os.scandir(directory or '.') as it:
+                present = {entry.name for entry in it if entry.is_file()}
+        except OSError: # Directory missing or unreadable
+            present = set()
+        missing.extend(path for path in dir_paths
+                       if os.path.basename(path) not in present and not os.path.isfile(path))
+    return missing
 
 def read_config(config_path):
     """Reads the configuration file (JSON format).
@@ -25,15 +127,15 @@ def read_config(config_path):
     }
 
     Returns:
-        tuple: (list of docx file info dicts, boolean keep_intermediates setting)
+        tuple: (list of docx file info dicts, boolean keep_intermediates setting).
+        Each dict's "compilation_date" is a datetime.date.
     """
     keep_intermediates_default = True
     config_data = []
     keep_intermediates = keep_intermediates_default
 
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        config = json_utils.load_file(config_path)
 
         # Get keep_intermediates setting
         keep_intermediates = config.get("keep_intermediates", keep_intermediates_default)
@@ -46,39 +148,30 @@ def read_config(config_path):
             print(f"Error: Config file '{config_path}' must contain a 'docx_files' list.", file=sys.stderr)
             return None, keep_intermediates # Return None for data to indicate error
 
-        config_dir = os.path.dirname(os.path.abspath(config_path))
-        for item in config["docx_files"]:
-            if not isinstance(item, dict):
-                print(f"Error: Entry in 'docx_files' is not a dictionary: {item}", file=sys.stderr)
-                return None, keep_intermediates
-            
-            required_keys = ["path", "act_name", "compilation_date"]
-            if not all(key in item for key in required_keys):
-                print(f"Error: Entry in 'docx_files' is missing required keys ({required_keys}): {item}", file=sys.stderr)
-                return None, keep_intermediates
-
-            # Basic validation (can be expanded)
-            if not isinstance(item["path"], str) or not item["path"].lower().endswith(".docx"):
-                print(f"Error: Invalid 'path' in docx_files entry: {item['path']}", file=sys.stderr)
-                return None, keep_intermediates
-            if not isinstance(item["act_name"], str) or not item["act_name"].strip():
-                 print(f"Error: Invalid 'act_name' in docx_files entry: {item['act_name']}", file=sys.stderr)
-                 return None, keep_intermediates
-            # Basic date format check (YYYY-MM-DD)
-            try:
-                 datetime.datetime.strptime(item["compilation_date"], '%Y-%m-%d')
-            except ValueError:
-                 print(f"Error: Invalid 'compilation_date' format (use YYYY-MM-DD): {item['compilation_date']}", file=sys.stderr)
-                 return None, keep_intermediates
-
-            # Resolve path relative to config file
-            resolved_path = os.path.abspath(os.path.join(config_dir, item['path']))
+        try:
+            entries = _DOCX_ENTRIES_ADAPTER.validate_python(config["docx_files"])
+        except ValidationError as e:
+            for error in e.errors():
+                location = ".".join(str(part) for part in error["loc"])
+                print(f"Error: Invalid docx_files entry [{location}]: {error['msg']} (got {error.get('input')!r})", file=sys.stderr)
+            return None, keep_intermediates
+
+        config_dir_abs = os.path.dirname(os.path.abspath(config_path))
+        for entry in entries:
+            # Resolve path relative to config file (config_dir_abs is already absolute)
             config_data.append({
-                "path": resolved_path,
-                "act_name": item["act_name"].strip(),
-                "compilation_date": item["compilation_date"]
+                "path": os.path.normpath(os.path.join(config_dir_abs, entry.path)),
+                "act_name": entry.act_name,
+                "compilation_date": entry.compilation_date
             })
 
+        # Report every missing DOCX up front, before any Supabase data is deleted
+        missing_paths = _find_missing_files(entry["path"] for entry in config_data)
+        if missing_paths:
+            for path in missing_paths:
+                print(f"Error: DOCX file listed in config not found: {path}", file=sys.stderr)
+            return None, keep_intermediates
+
         return config_data, keep_intermediates
 
     except FileNotFoundError:
@@ -98,36 +191,35 @@ def delete_act_data_from_supabase(act_names_to_delete):
         print("No act names specified for deletion. Skipping.")
         return True
 
-    load_dotenv() # Load .env file for credentials
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_key = os.environ.get("SUPABASE_KEY")
-
-    if not supabase_url or not supabase_key:
-        print("Error: SUPABASE_URL and SUPABASE_KEY must be set in environment variables or .env file for deletion step.", file=sys.stderr)
-        return False
-
     try:
         print(f"Initializing Supabase client for deletion...")
-        supabase: Client = create_client(supabase_url, supabase_key)
+        supabase = _get_supabase()
+        if supabase is None:
+            print("Error: SUPABASE_URL and SUPABASE_KEY must be set in environment variables or .env file for deletion step.", file=sys.stderr)
+            return False
         print("Supabase client initialized.")
         
-        table_name = 'sections' # Hardcoded table name, consistent with upload script
+        table_name = SUPABASE_TABLE_NAME
         all_success = True
 
-        for act_name in act_names_to_delete:
-            print(f"Deleting data for Act: '{act_name}' from table '{table_name}'...")
+        # One DELETE ... WHERE act_name IN (...) round-trip per batch of names
+        # instead of one per act. Only the affected row count is requested back
+        # (returning='minimal'), so the deleted rows (with their embeddings)
+        # are not sent over the wire.
+        act_names = list(act_names_to_delete)
+        for i in range(0, len(act_names), DELETE_BATCH_SIZE):
+            batch = act_names[i:i + DELETE_BATCH_SIZE]
+            print(f"Deleting data for Acts: {batch} from table '{table_name}'...")
             try:
-                # Execute the delete operation
-                response = supabase.table(table_name).delete().eq('act_name', act_name).execute()
-                # Basic check: Supabase API v1+ might not have a detailed count in the response
-                # We assume success if no exception is raised. Check docs if specific counts are needed.
-                print(f"  Deletion command executed for '{act_name}'.")
-                # Optional: Add more robust response checking if API provides it
-                # if hasattr(response, 'error') and response.error:
-                #    print(f"  Error deleting data for '{act_name}': {response.error}", file=sys.stderr)
-                #    all_success = False
+                response = (
+                    supabase.table(table_name)
+                    .delete(count='exact', returning='minimal')
+                    .in_('act_name', batch)
+                    .execute()
+                )
+                print(f"  Deletion command executed; {response.count} rows removed.")
             except Exception as delete_error:
-                print(f"  Error during Supabase delete operation for '{act_name}': {delete_error}", file=sys.stderr)
+                print(f"  Error during Supabase delete operation for {batch}: {delete_error}", file=sys.stderr)
                 all_success = False
         
         print("--- Finished Supabase deletion step ---")
@@ -138,14 +230,17 @@ def delete_act_data_from_supabase(act_names_to_delete):
         print("--- Finished Supabase deletion step (with error) ---")
         return False
 
-def process_single_file(docx_path, act_name, compilation_date, save_intermediates=True):
-    """Processes a single DOCX file through the pipeline."""
-    print(f"\nStarting processing for: {docx_path}")
-    print(f"  Act Name: {act_name}")
-    print(f"  Compilation Date: {compilation_date}")
-    base_path_no_ext, _ = os.path.splitext(docx_path)
-    output_dir = os.path.dirname(docx_path) or '.'
-    file_basename = os.path.basename(base_path_no_ext)
+def _build_document(docx_path, output_dir, file_basename, final_json_path, save_intermediates):
+    """Runs Steps 1-4 in-process and returns the sections with embeddings.
+
+    The document is passed between steps as a dictionary; JSON snapshots
+    (including the final JSON, which lets later runs skip these steps) are
+    only written when intermediates are kept.
+
+    Returns:
+        dict: The final document, or None if a step failed.
+    """
+    docx_name = os.path.basename(docx_path) # For error messages
 
     # --- Step 1: DOCX to HTML ---
     print(f"  Step 1: Convert DOCX to HTML")
@@ -153,396 +248,237 @@ def process_single_file(docx_path, act_name, compilation_date, save_intermediate
     mammoth_html_path = os.path.join(output_dir, f"{file_basename}.mammoth.html")
 
     try:
-        # Assuming docx_to_html.py is executable and takes input/output paths
-        # Example: python docx_to_html.py <input_docx> <output_html>
-        script_path = os.path.join(os.path.dirname(__file__), "docx_to_html.py") # Assume script is in the same dir
-        if not os.path.exists(script_path):
-             # Try finding it in the current working directory if not besides process_act.py
-             script_path = "docx_to_html.py"
-             if not os.path.exists(script_path):
-                 print(f"  Error: Cannot find the 'docx_to_html.py' script.", file=sys.stderr)
-                 return False # Indicate failure for this file
-
-        cmd = [sys.executable, script_path, docx_path, mammoth_html_path]
-        print(f"    Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"    Successfully generated HTML: {mammoth_html_path}")
-        # print(f"    STDOUT:\n{result.stdout}") # Uncomment for debugging stdout
-        # print(f"    STDERR:\n{result.stderr}") # Uncomment for debugging stderr
-
-        # User mentioned intermediate xxx.mammoth_html.json.
-        # Let's read the generated HTML and save it as JSON for the next step.
-        intermediate_json_path = os.path.join(output_dir, f"{file_basename}_mammoth_html.json")
-        try:
-            with open(mammoth_html_path, 'r', encoding='utf-8') as f_html:
-                html_content = f_html.read()
-            with open(intermediate_json_path, 'w', encoding='utf-8') as f_json:
-                json.dump({"html_content": html_content}, f_json, indent=2)
-            print(f"    Saved intermediate HTML content to: {intermediate_json_path}")
-
-            # Clean up the raw .html file if intermediates are not kept,
-            # but keep the json version as it might be the input for the next step.
-            if not save_intermediates:
-                 os.remove(mammoth_html_path)
-                 print(f"    Removed intermediate file: {mammoth_html_path}")
-
-        except Exception as e:
-            print(f"  Error processing/saving intermediate HTML for {docx_path}: {e}", file=sys.stderr)
-            # Decide if this is fatal for this file's processing
-            # Clean up intermediate file potentially?
-            if os.path.exists(mammoth_html_path):
-                 try: os.remove(mammoth_html_path)
-                 except OSError: pass
-            if os.path.exists(intermediate_json_path):
-                 try: os.remove(intermediate_json_path)
-                 except OSError: pass
-            return False # Indicate failure
-
-    except FileNotFoundError:
-         # This catches if sys.executable (python interpreter) isn't found.
-         print(f"  Error: Python interpreter '{sys.executable}' not found?", file=sys.stderr)
-         return False
-    except subprocess.CalledProcessError as e:
-        print(f"  Error running docx_to_html.py for {docx_path}:", file=sys.stderr)
-        print(f"    Return Code: {e.returncode}", file=sys.stderr)
-        # Attempt to decode stderr/stdout if they are bytes
-        stderr_str = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
-        stdout_str = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else e.stdout
-        print(f"    Stderr: {stderr_str}", file=sys.stderr)
-        print(f"    Stdout: {stdout_str}", file=sys.stderr) # Include stdout for context
-        return False # Indicate failure
+        # Runs in-process: the HTML stays in memory for Step 2 and is only
+        # written to disk when intermediates are kept.
+        html_content, messages = docx_to_html.docx_to_html_string(docx_path)
+        for message in messages:
+            logging.info("mammoth: %s", message)
+        html_content = docx_to_html.prepare_html_for_images(html_content)
+        if save_intermediates:
+            with open(mammoth_html_path, 'w', encoding='utf-8') as f_html:
+                f_html.write(html_content)
+            print(f"    Saved HTML snapshot: {mammoth_html_path}")
+        print(f"    Successfully converted DOCX to HTML ({len(messages)} conversion messages).")
     except Exception as e:
         print(f"  An unexpected error occurred during Step 1 for {docx_path}: {e}", file=sys.stderr)
-        return False # Indicate failure
-
-    # --- Placeholder for subsequent steps ---
-    current_step_input = intermediate_json_path 
+        return None # Indicate failure
 
-    # Step 2: HTML Parser
-    print(f"  Step 2: Parse HTML (using {os.path.basename(current_step_input)})")
+    # --- Steps 2-3.5: Parse HTML, Convert EMF Images, Apply Styling ---
+    # These steps run in-process as one pass over an in-memory dictionary,
+    # which Step 4 also takes directly. Snapshots (.parsed.json,
+    # .converted.json, .styled.json) are only written when intermediates
+    # are kept.
     parsed_json_path = os.path.join(output_dir, f"{file_basename}.parsed.json")
+    converted_json_path = os.path.join(output_dir, f"{file_basename}.converted.json")
+    styled_json_path = os.path.join(output_dir, f"{file_basename}.styled.json")
 
+    # --- Step 2: HTML Parser ---
+    print(f"  Step 2: Parse HTML")
     try:
-        script_path = os.path.join(os.path.dirname(__file__), "html_parser.py")
-        if not os.path.exists(script_path):
-             script_path = "html_parser.py" # Try current dir
-             if not os.path.exists(script_path):
-                 print(f"  Error: Cannot find the 'html_parser.py' script.", file=sys.stderr)
-                 # Cleanup previous intermediate if needed
-                 if not save_intermediates and os.path.exists(current_step_input):
-                     try: os.remove(current_step_input)
-                     except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-                 return False # Indicate failure
-
-        cmd = [sys.executable, script_path, current_step_input, parsed_json_path]
-        print(f"    Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"    Successfully generated parsed JSON: {parsed_json_path}")
-        # print(f"    STDOUT:\n{result.stdout}") # Uncomment for debugging stdout
-        # print(f"    STDERR:\n{result.stderr}") # Uncomment for debugging stderr
-
-        # Cleanup previous intermediate file if requested
-        if not save_intermediates and os.path.exists(current_step_input):
-             try:
-                 os.remove(current_step_input)
-                 print(f"    Removed intermediate file: {current_step_input}")
-             except OSError as e:
-                 print(f"  Warning: Could not remove intermediate file {current_step_input}: {e}", file=sys.stderr)
-
-        current_step_output = parsed_json_path # Update for the next step
-
-    except FileNotFoundError:
-         print(f"  Error: Python interpreter '{sys.executable}' not found?", file=sys.stderr)
-         # Cleanup potentially created files if step fails midway? Difficult.
-         return False
-    except subprocess.CalledProcessError as e:
-        print(f"  Error running html_parser.py for {os.path.basename(docx_path)}:", file=sys.stderr)
-        print(f"    Return Code: {e.returncode}", file=sys.stderr)
-        stderr_str = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
-        stdout_str = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else e.stdout
-        print(f"    Stderr: {stderr_str}", file=sys.stderr)
-        print(f"    Stdout: {stdout_str}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-            try: os.remove(current_step_input)
-            except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(parsed_json_path):
-             try: os.remove(parsed_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {parsed_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
+        document = html_parser.transform_html(html_content)
+        del html_content # Release the raw HTML before the next steps
+        if save_intermediates:
+            json_utils.dump_file(document, parsed_json_path)
+            print(f"    Saved parsed JSON snapshot: {parsed_json_path}")
+        print(f"    Successfully parsed {len(document)} sections.")
     except Exception as e:
-        print(f"  An unexpected error occurred during Step 2 for {os.path.basename(docx_path)}: {e}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-             try: os.remove(current_step_input)
-             except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(parsed_json_path):
-             try: os.remove(parsed_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {parsed_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
-
-    # --- Step 3: Convert EMF Images --- 
-    # Input is the .parsed.json from Step 2
-    current_step_input = parsed_json_path # Rename for clarity
-    print(f"  Step 3: Convert EMF Images (using {os.path.basename(current_step_input)})")
-    converted_json_path = os.path.join(output_dir, f"{file_basename}.converted.json")
+        print(f"  An unexpected error occurred during Step 2 for {docx_name}: {e}", file=sys.stderr)
+        return None # Indicate failure
 
+    # --- Step 3: Convert EMF Images ---
+    print(f"  Step 3: Convert EMF Images")
     try:
-        script_path = os.path.join(os.path.dirname(__file__), "convert_emf_images.py")
-        if not os.path.exists(script_path):
-             script_path = "convert_emf_images.py" # Try current dir
-             if not os.path.exists(script_path):
-                 print(f"  Error: Cannot find the 'convert_emf_images.py' script.", file=sys.stderr)
-                 # Cleanup previous intermediate if needed
-                 if not save_intermediates and os.path.exists(current_step_input):
-                     try: os.remove(current_step_input)
-                     except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-                 return False # Indicate failure
-
-        cmd = [sys.executable, script_path, current_step_input, converted_json_path]
-        print(f"    Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"    Successfully generated converted JSON: {converted_json_path}")
-        # print(f"    STDOUT:\n{result.stdout}") # Uncomment for debugging stdout
-        # print(f"    STDERR:\n{result.stderr}") # Uncomment for debugging stderr
-
-        # Cleanup previous intermediate file if requested
-        if not save_intermediates and os.path.exists(current_step_input):
-             try:
-                 os.remove(current_step_input)
-                 print(f"    Removed intermediate file: {current_step_input}")
-             except OSError as e:
-                 print(f"  Warning: Could not remove intermediate file {current_step_input}: {e}", file=sys.stderr)
-
-        current_step_output = converted_json_path # Update for the next step
-
-    except FileNotFoundError:
-         print(f"  Error: Python interpreter '{sys.executable}' not found?", file=sys.stderr)
-         return False
-    except subprocess.CalledProcessError as e:
-        print(f"  Error running convert_emf_images.py for {os.path.basename(docx_path)}:", file=sys.stderr)
-        print(f"    Return Code: {e.returncode}", file=sys.stderr)
-        stderr_str = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
-        stdout_str = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else e.stdout
-        print(f"    Stderr: {stderr_str}", file=sys.stderr)
-        print(f"    Stdout: {stdout_str}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-            try: os.remove(current_step_input)
-            except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(converted_json_path):
-             try: os.remove(converted_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {converted_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
+        if not convert_emf_images.check_dependencies():
+            print(f"  Error: Image converter dependency check failed for {docx_name}.", file=sys.stderr)
+            return None # Indicate failure
+        image_output_dir = os.path.join(output_dir, convert_emf_images.DEFAULT_OUTPUT_IMAGE_SUBDIR)
+        document = convert_emf_images.transform_dict(document, image_output_dir)
+        if document is None:
+            print(f"  Error: Image conversion failed for {docx_name}.", file=sys.stderr)
+            return None # Indicate failure
+        if save_intermediates:
+            json_utils.dump_file(document, converted_json_path)
+            print(f"    Saved converted JSON snapshot: {converted_json_path}")
     except Exception as e:
-        print(f"  An unexpected error occurred during Step 3 for {os.path.basename(docx_path)}: {e}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-             try: os.remove(current_step_input)
-             except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(converted_json_path):
-             try: os.remove(converted_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {converted_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
-
-    # --- Step 3.5: Apply HTML Styling --- 
-    # Input is the .converted.json from Step 3
-    current_step_input = converted_json_path # Rename for clarity
-    print(f"  Step 3.5: Apply HTML Styling (using {os.path.basename(current_step_input)})")
-    styled_json_path = os.path.join(output_dir, f"{file_basename}.styled.json")
+        print(f"  An unexpected error occurred during Step 3 for {docx_name}: {e}", file=sys.stderr)
+        return None # Indicate failure
 
+    # --- Step 3.5: Apply HTML Styling ---
+    print(f"  Step 3.5: Apply HTML Styling")
     try:
-        script_path = os.path.join(os.path.dirname(__file__), "style_html_content.py")
-        if not os.path.exists(script_path):
-             script_path = "style_html_content.py" # Try current dir
-             if not os.path.exists(script_path):
-                 print(f"  Error: Cannot find the 'style_html_content.py' script.", file=sys.stderr)
-                 # Cleanup previous intermediate if needed
-                 if not save_intermediates and os.path.exists(current_step_input):
-                     try: os.remove(current_step_input)
-                     except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-                 return False # Indicate failure
-
-        cmd = [sys.executable, script_path, current_step_input, styled_json_path]
-        print(f"    Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"    Successfully generated styled JSON: {styled_json_path}")
-        # print(f"    STDOUT:\n{result.stdout}") # Uncomment for debugging stdout
-        # print(f"    STDERR:\n{result.stderr}") # Uncomment for debugging stderr
-
-        # Cleanup previous intermediate file if requested
-        if not save_intermediates and os.path.exists(current_step_input):
-             try:
-                 os.remove(current_step_input)
-                 print(f"    Removed intermediate file: {current_step_input}")
-             except OSError as e:
-                 print(f"  Warning: Could not remove intermediate file {current_step_input}: {e}", file=sys.stderr)
-
-        current_step_output = styled_json_path # Update for the next step (Embeddings)
-
-    except FileNotFoundError:
-         print(f"  Error: Python interpreter '{sys.executable}' not found?", file=sys.stderr)
-         return False
-    except subprocess.CalledProcessError as e:
-        print(f"  Error running style_html_content.py for {os.path.basename(docx_path)}:", file=sys.stderr)
-        print(f"    Return Code: {e.returncode}", file=sys.stderr)
-        stderr_str = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
-        stdout_str = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else e.stdout
-        print(f"    Stderr: {stderr_str}", file=sys.stderr)
-        print(f"    Stdout: {stdout_str}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-            try: os.remove(current_step_input)
-            except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(styled_json_path):
-             try: os.remove(styled_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {styled_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
+        document = style_html_content.transform_dict(document)
+        if save_intermediates:
+            json_utils.dump_file(document, styled_json_path)
+            print(f"    Saved styled JSON snapshot: {styled_json_path}")
+        print(f"    Successfully styled {len(document)} sections.")
     except Exception as e:
-        print(f"  An unexpected error occurred during Step 3.5 (Styling) for {os.path.basename(docx_path)}: {e}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-             try: os.remove(current_step_input)
-             except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(styled_json_path):
-             try: os.remove(styled_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {styled_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
+        print(f"  An unexpected error occurred during Step 3.5 (Styling) for {docx_name}: {e}", file=sys.stderr)
+        # Cleanup the potentially incomplete snapshot of this step
+        if save_intermediates:
+            _safe_unlink(styled_json_path, warn_label="potentially incomplete file")
+        return None # Indicate failure
 
     # --- Step 4: Create Embeddings --- 
-    # Input is the .styled.json from Step 3.5
-    current_step_input = styled_json_path # Update input source
-    print(f"  Step 4: Create Embeddings (using {os.path.basename(current_step_input)})")
+    print(f"  Step 4: Create Embeddings")
+    try:
+        embedded_count = create_embeddings.embed_sections(document)
+        if save_intermediates:
+            json_utils.dump_file(document, final_json_path)
+            print(f"    Saved final JSON with embeddings: {final_json_path}")
+        print(f"    Successfully embedded {embedded_count} sections.")
+    except Exception as e:
+        print(f"  An unexpected error occurred during Step 4 for {docx_name}: {e}", file=sys.stderr)
+        # Cleanup the potentially incomplete output of this step
+        _safe_unlink(final_json_path, warn_label="potentially incomplete file")
+        return None # Indicate failure
+
+    return document
+
+def process_single_file(docx_path, act_name, compilation_date, save_intermediates=True, force=False):
+    """Processes a single DOCX file through the pipeline.
+
+    If the final JSON from a previous run is at least as new as the DOCX,
+    Steps 1-4 are skipped and it is uploaded directly, unless force is set.
+    """
+    print(f"\nStarting processing for: {docx_path}")
+    print(f"  Act Name: {act_name}")
+    print(f"  Compilation Date: {compilation_date}")
+    base_path_no_ext, _ = os.path.splitext(docx_path)
+    output_dir = os.path.dirname(docx_path) or '.'
+    file_basename = os.path.basename(base_path_no_ext)
+    docx_name = os.path.basename(docx_path) # For log messages
     # This is the FINAL output file for this document
     final_json_path = os.path.join(output_dir, f"{file_basename}.json")
 
     try:
-        script_path = os.path.join(os.path.dirname(__file__), "create_embeddings.py")
-        if not os.path.exists(script_path):
-             script_path = "create_embeddings.py" # Try current dir
-             if not os.path.exists(script_path):
-                 print(f"  Error: Cannot find the 'create_embeddings.py' script.", file=sys.stderr)
-                 # Cleanup previous intermediate if needed
-                 if not save_intermediates and os.path.exists(current_step_input):
-                     try: os.remove(current_step_input)
-                     except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-                 return False # Indicate failure
-
-        cmd = [sys.executable, script_path, current_step_input, final_json_path]
-        print(f"    Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"    Successfully generated final JSON with embeddings: {final_json_path}")
-        # print(f"    STDOUT:\n{result.stdout}") # Uncomment for debugging stdout
-        # print(f"    STDERR:\n{result.stderr}") # Uncomment for debugging stderr
-
-        # Cleanup previous intermediate file if requested
-        if not save_intermediates and os.path.exists(current_step_input):
-             try:
-                 os.remove(current_step_input)
-                 print(f"    Removed intermediate file: {current_step_input}")
-             except OSError as e:
-                 print(f"  Warning: Could not remove intermediate file {current_step_input}: {e}", file=sys.stderr)
-
-        # No more steps, this was the last output
-        # current_step_output = final_json_path 
-
-    except FileNotFoundError:
-         print(f"  Error: Python interpreter '{sys.executable}' not found?", file=sys.stderr)
-         return False
-    except subprocess.CalledProcessError as e:
-        print(f"  Error running create_embeddings.py for {os.path.basename(docx_path)}:", file=sys.stderr)
-        print(f"    Return Code: {e.returncode}", file=sys.stderr)
-        stderr_str = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
-        stdout_str = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else e.stdout
-        print(f"    Stderr: {stderr_str}", file=sys.stderr)
-        print(f"    Stdout: {stdout_str}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-            try: os.remove(current_step_input)
-            except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(final_json_path):
-             try: os.remove(final_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {final_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
-    except Exception as e:
-        print(f"  An unexpected error occurred during Step 4 for {os.path.basename(docx_path)}: {e}", file=sys.stderr)
-        # Cleanup previous intermediate if needed
-        if not save_intermediates and os.path.exists(current_step_input):
-             try: os.remove(current_step_input)
-             except OSError as rm_err: print(f"  Warning: Could not remove intermediate file {current_step_input}: {rm_err}", file=sys.stderr)
-        # Also cleanup the potentially incomplete output of this step
-        if os.path.exists(final_json_path):
-             try: os.remove(final_json_path)
-             except OSError as rm_err: print(f"  Warning: Could not remove potentially incomplete file {final_json_path}: {rm_err}", file=sys.stderr)
-        return False # Indicate failure
+        up_to_date = not force and os.path.getmtime(final_json_path) >= os.path.getmtime(docx_path)
+    except OSError:
+        up_to_date = False # No final JSON from a previous run
+    if up_to_date:
+        print(f"  Steps 1-4 skipped: {file_basename}.json is up to date (use --force to rebuild).")
+        document = upload_to_supabase.load_json_data(final_json_path)
+        if not isinstance(document, dict):
+            print(f"  Error: Could not load {final_json_path}; rerun with --force to rebuild it.", file=sys.stderr)
+            return False # Indicate failure
+    else:
+        document = _build_document(docx_path, output_dir, file_basename, final_json_path, save_intermediates)
+        if document is None:
+            return False # Indicate failure
 
     # --- Step 5: Upload to Supabase --- 
-    # Input is the final JSON file from Step 4
-    current_step_input = final_json_path # Rename for clarity
-    print(f"  Step 5: Upload to Supabase (using {os.path.basename(current_step_input)})")
+    print(f"  Step 5: Upload to Supabase")
 
     try:
-        script_path = os.path.join(os.path.dirname(__file__), "upload_to_supabase.py")
-        if not os.path.exists(script_path):
-             script_path = "upload_to_supabase.py" # Try current dir
-             if not os.path.exists(script_path):
-                 print(f"  Error: Cannot find the 'upload_to_supabase.py' script.", file=sys.stderr)
-                 # Don't automatically clean up final file on upload script missing
-                 return False # Indicate failure
-
-        # Pass json path, act name, and compilation date to the upload script
-        cmd = [sys.executable, script_path, current_step_input, act_name, compilation_date]
-        print(f"    Running command: {' '.join(cmd)}")
-        # NOTE: We assume the upload script handles its own Supabase errors internally
-        # and exits non-zero if it fails critically.
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"    Successfully ran upload script for: {current_step_input}")
-        # print(f"    STDOUT:\n{result.stdout}") # Uncomment for debugging stdout
-        # print(f"    STDERR:\n{result.stderr}") # Uncomment for debugging stderr
-
-        # Optional: Cleanup final JSON file if intermediates are not kept?
-        # For now, we follow the keep_intermediates flag for the final file too.
-        if not save_intermediates and os.path.exists(current_step_input):
-             try:
-                 os.remove(current_step_input)
-                 print(f"    Removed final JSON file: {current_step_input}")
-             except OSError as e:
-                 print(f"  Warning: Could not remove final JSON file {current_step_input}: {e}", file=sys.stderr)
+        # Runs in-process so the Supabase client (and its connection) is
+        # shared with the deletion step and across files.
+        supabase = _get_supabase()
+        if supabase is None:
+            print(f"  Error: Supabase credentials are not configured; cannot upload {docx_name}.", file=sys.stderr)
+            return False # Indicate failure
+        if not upload_to_supabase.upload_sections(document, act_name, compilation_date, client=supabase):
+            print(f"  Error: Upload failed for {docx_name}.", file=sys.stderr)
+            return False # Indicate failure
+        print(f"    Successfully uploaded {len(document)} sections.")
 
-    except FileNotFoundError:
-         print(f"  Error: Python interpreter '{sys.executable}' not found?", file=sys.stderr)
-         return False
-    except subprocess.CalledProcessError as e:
-        print(f"  Error running upload_to_supabase.py for {os.path.basename(docx_path)}:", file=sys.stderr)
-        print(f"    Return Code: {e.returncode}", file=sys.stderr)
-        stderr_str = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
-        stdout_str = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else e.stdout
-        print(f"    Stderr: {stderr_str}", file=sys.stderr)
-        print(f"    Stdout: {stdout_str}", file=sys.stderr)
-        # Don't automatically clean up file if upload fails
-        return False # Indicate failure
     except Exception as e:
-        print(f"  An unexpected error occurred during Step 5 for {os.path.basename(docx_path)}: {e}", file=sys.stderr)
-        # Don't automatically clean up file if upload fails
+        print(f"  An unexpected error occurred during Step 5 for {docx_name}: {e}", file=sys.stderr)
         return False # Indicate failure
 
     # --- Pipeline Complete --- 
-    print(f"  Pipeline finished successfully for {os.path.basename(docx_path)}. Final data uploaded.")
+    print(f"  Pipeline finished successfully for {docx_name}. Final data uploaded.")
     print("-" * 20)
     return True # Indicate success for this file
 
+def _process_file(file_info, save_intermediates, force):
+    """Runs the pipeline for one config entry. Returns True on success."""
+    docx_path = file_info['path']
+    print(f"\nProcessing: {os.path.basename(docx_path)} (Act: '{file_info['act_name']}')")
+    # Existence and the .docx extension were already checked in read_config
+    return process_single_file(docx_path, file_info['act_name'], file_info['compilation_date'],
+                               save_intermediates=save_intermediates, force=force)
+
+def _console_log_handler(stream):
+    """Returns the handler that shows warnings and above on stream."""
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(logging.WARNING)
+    handler.setFormatter(logging.Formatter(CONSOLE_LOG_FORMAT))
+    return handler
+
+def _init_worker(profile_root, log_queue, torch_threads):
+    """Process pool initializer.
+
+    Drops any Supabase client inherited from the parent (a forked worker would
+    otherwise share the parent's pooled HTTP connections; each worker creates
+    its own client on first use instead) and gives the worker its own
+    LibreOffice profile under profile_root.
+
+    Log records are sent to the parent through log_queue (it writes them to
+    the log file), whatever the start method; handlers inherited under fork
+    are dropped. Console output is added per file by _process_file_captured.
+    torch is limited to torch_threads threads so the workers' embedding
+    models don't oversubscribe the CPU.
+    """
+    global _SUPABASE_CLIENT
+    _SUPABASE_CLIENT = None
+    convert_emf_images.LIBREOFFICE_PROFILE_DIR = os.path.join(profile_root, str(os.getpid()))
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+
+    import torch # Only needed here; the embedding step imports it anyway
+    torch.set_num_threads(torch_threads)
+
+def _process_file_captured(file_info, save_intermediates, force):
+    """Worker entry point: runs _process_file with its output captured.
+
+    Returns:
+        tuple: (success, output) so the parent can print each file's output
+        as one block instead of interleaving concurrent files.
+    """
+    buffer = io.StringIO()
+    # Warnings go to the same buffer, in order with the printed output
+    console_handler = _console_log_handler(buffer)
+    logging.getLogger().addHandler(console_handler)
+    try:
+        with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+            try:
+                success = _process_file(file_info, save_intermediates, force)
+            except Exception as e:
+                print(f"  An unexpected error occurred for {os.path.basename(file_info['path'])}: {e}")
+                success = False
+    finally:
+        logging.getLogger().removeHandler(console_handler)
+    return success, buffer.getvalue()
+
+def _pipeline_workers(file_count):
+    """Returns the number of worker processes to use, from PIPELINE_WORKERS."""
+    workers = DEFAULT_PIPELINE_WORKERS
+    env_value = os.environ.get("PIPELINE_WORKERS")
+    if env_value:
+        try:
+            workers = int(env_value)
+        except ValueError:
+            print(f"Warning: Invalid PIPELINE_WORKERS value '{env_value}'. Using {workers}.", file=sys.stderr)
+    return max(1, min(workers, file_count))
+
 def main():
     parser = argparse.ArgumentParser(description="Process DOCX files through a defined pipeline.")
     parser.add_argument("config_file", help="Path to the configuration file (JSON).")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every file even if its final JSON is newer than the DOCX.")
     args = parser.parse_args()
 
+    # --- Configure Logging ---
+    # The steps run in-process; the parsing/conversion steps log through the logging module:
+    # full INFO detail goes to the log file, warnings and above to the console.
+    file_handler = logging.FileHandler(LOG_FILE, mode='w') # Overwrite log file each time
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.basicConfig(level=logging.INFO, handlers=[file_handler, _console_log_handler(sys.stderr)])
+    # --- End Logging Configuration ---
+
     config_data, keep_intermediates = read_config(args.config_file)
 
     if config_data is None:
@@ -570,32 +506,44 @@ def main():
               print("Supabase pre-deletion completed successfully.")
     # --- End Pre-Deletion --- 
 
-    print(f"\nProcessing {len(config_data)} files (Keep intermediates: {keep_intermediates})")
-    successful_files = 0
-    failed_files = 0
-    # Loop through the list of file information dictionaries
-    for file_info in config_data:
-        docx_path = file_info['path']
-        act_name = file_info['act_name']
-        compilation_date = file_info['compilation_date']
-
-        print(f"\nProcessing: {os.path.basename(docx_path)} (Act: '{act_name}')")
-        if not os.path.exists(docx_path):
-            print(f"  Warning: File not found, skipping: {docx_path}", file=sys.stderr)
-            failed_files += 1
-            continue
-        if not docx_path.lower().endswith(".docx"):
-             print(f"  Warning: File does not have .docx extension, skipping: {docx_path}", file=sys.stderr)
-             failed_files += 1
-             continue
-
-        # Process the file, passing the setting from the config and act info
-        success = process_single_file(docx_path, act_name, compilation_date, save_intermediates=keep_intermediates)
-        if success:
-            successful_files += 1
-        else:
-            failed_files += 1
-            print(f"Failed to process: {os.path.basename(docx_path)}")
+    workers = _pipeline_workers(len(config_data))
+    print(f"\nProcessing {len(config_data)} files (Keep intermediates: {keep_intermediates}, Workers: {workers})")
+    failed_names = []
+    if workers == 1:
+        # Serial run in this process, with live output
+        for file_info in config_data:
+            if not _process_file(file_info, keep_intermediates, args.force):
+                failed_names.append(os.path.basename(file_info['path']))
+                print(f"Failed to process: {failed_names[-1]}")
+    else:
+        # Files are independent; each worker's output is printed as one block when it finishes.
+        # Worker log records come back through log_queue and go to the log file.
+        log_queue = multiprocessing.Queue()
+        log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        log_listener.start()
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        try:
+            with tempfile.TemporaryDirectory(prefix="process_act_lo_") as profile_root, \
+                 ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(profile_root, log_queue, torch_threads)) as executor:
+                futures = {
+                    executor.submit(_process_file_captured, file_info, keep_intermediates, args.force): file_info
+                    for file_info in config_data
+                }
+                for future in as_completed(futures):
+                    file_name = os.path.basename(futures[future]['path'])
+                    try:
+                        success, output = future.result()
+                    except Exception as e: # e.g. the worker process died
+                        success, output = False, f"\n  Worker failed for {file_name}: {e}\n"
+                    print(output, end='')
+                    if not success:
+                        failed_names.append(file_name)
+                        print(f"Failed to process: {file_name}")
+        finally:
+            log_listener.stop() # Writes out the records still queued
+    successful_files = len(config_data) - len(failed_names)
+    failed_files = len(failed_names)
 
     print("\n--- Summary ---")
     print(f"Successfully processed: {successful_files}")
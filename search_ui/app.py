@@ -1,16 +1,51 @@
 import streamlit as st
 import time
 import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from sentence_transformers import SentenceTransformer
 import sys
+# Modules shared with the pipeline and the API live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json_utils
+from embedding_utils import load_quantized_onnx_model
+from style_html_content import SECTION_CSS
+# torch and sentence_transformers are imported where the model is loaded: they
+# take seconds to import, which the login page shouldn't have to wait for
 
 # --- Configuration Loading (Adapted for Streamlit) ---
-load_dotenv()
+# Encoded once when the model is loaded: a short and a long input, so the
+# first real search doesn't pay for lazy kernel setup (or torch.compile)
+WARMUP_QUERIES = ["warmup", " ".join(["warmup query for the embedding model"] * 32)]
 
+# Backslash-escapes markdown syntax in plain text shown through st.markdown;
+# '$' included, or amounts like "$1,000 ... $5,000" would render as LaTeX
+MARKDOWN_ESCAPES = str.maketrans({char: '\\' + char for char in '\\`*_{}[]()<>#+-.!|$~'})
+
+# Lets tables in a section's HTML use the full width of the results column
+TABLE_OVERRIDE_CSS = """
+<style>
+    div[data-testid="stMarkdownContainer"] table {
+        width: 100% !important; table-layout: auto !important; border-collapse: collapse;
+    }
+    div[data-testid="stMarkdownContainer"] table th,
+    div[data-testid="stMarkdownContainer"] table td {
+        width: auto !important; border: 1px solid #ccc; padding: 6px; text-align: left; vertical-align: top;
+    }
+</style>
+"""
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def load_app_config():
-    """Loads configuration needed for the Streamlit app (Auth + Search)."""
+    """Loads configuration needed for the Streamlit app (Auth + Search).
+
+    Cached: Streamlit reruns the script on every widget interaction, and
+    .env only needs to be read once.
+    """
+    load_dotenv()
     config = {
         "client_id": os.getenv("CLIENT_ID"),
         "client_secret": os.getenv("CLIENT_SECRET"),
@@ -18,26 +53,104 @@ def load_app_config():
         "redirect_uri": os.getenv("REDIRECT_URI"),
         "supabase_url": os.getenv("SUPABASE_URL"),
         "supabase_key": os.getenv("SUPABASE_KEY"),
-        "search_function": "match_sections",
+        "search_function": os.getenv("SEARCH_FUNCTION", "match_sections"), # match_sections_ip: inner product on unit vectors
+        "sections_table": "sections", # Queried directly for a result's HTML when the RPC omits it
         "embedding_model_name": os.getenv("EMBEDDING_MODEL", 'BAAI/bge-large-en-v1.5'),
+        # Optional local directory for the model; saved there on first load, then loaded without Hub access
+        "embedding_model_path": os.getenv("EMBEDDING_MODEL_PATH"),
+        # Separate directory for the int8 ONNX export (the 'onnx-int8' backend), so
+        # switching backends never loads one backend's files as the other's model
+        "embedding_onnx_path": os.getenv("EMBEDDING_ONNX_PATH"),
+        # Queries are short; capping the sequence length keeps attention cost down
+        # (longer queries are truncated to this many wordpieces)
+        "embedding_max_seq_length": int(os.getenv("QUERY_MAX_SEQ_LEN", 128)),
+        # 'torch' (FP32), 'torch-bf16' (bfloat16 weights, for CPUs with AVX512-BF16/AMX)
+        # or 'onnx-int8' (quantized ONNX Runtime graph, needs EMBEDDING_ONNX_PATH)
+        "embedding_backend": os.getenv("EMBEDDING_BACKEND", "torch"),
+        # Intra-op threads for the torch encoder; one short query gains little beyond a few
+        "torch_threads": int(os.getenv("TORCH_THREADS", min(4, os.cpu_count() or 1))),
+        # Compile the torch encoder with torch.compile (first query after start pays the compile)
+        "embedding_compile": os.getenv("EMBEDDING_COMPILE", "false").lower() in ("1", "true", "yes"),
+        # How long the encoder waits for concurrent sessions' queries to share a batch
+        "embedding_batch_wait_ms": int(os.getenv("EMBEDDING_BATCH_WAIT_MS", 10)),
         "search_limit": int(os.getenv("SEARCH_LIMIT", 5)),
         "allowed_domain": os.getenv("ALLOWED_DOMAIN", "adlvlaw.com.au")
     }
+    # print("Streamlit App Configuration loaded.") # Quieten console
+    return config
+
+def validate_config(config):
+    """Stops the app if Supabase isn't configured; warns if auth settings are missing."""
     if not all([config["supabase_url"], config["supabase_key"]]):
         st.error("FATAL ERROR: Supabase URL/Key not configured in search_ui/.env file.")
         st.stop()
     if not all([config["client_id"], config["tenant_id"], config["redirect_uri"]]):
          st.warning("Auth variables (CLIENT_ID, TENANT_ID, REDIRECT_URI) seem missing in search_ui/.env. Login might fail.")
-    # print("Streamlit App Configuration loaded.") # Quieten console
-    return config
 
 # --- Initialize Embedding Model (Cached) ---
+def convert_to_bfloat16(model):
+    """Casts the encoder weights to bfloat16.
+
+    Halves the weight bytes read per forward pass and lets CPUs with
+    AVX512-BF16/AMX run the matmuls natively. If Intel Extension for
+    PyTorch is installed, its optimized bfloat16 kernels are applied too.
+    """
+    import torch
+    model = model.to(torch.bfloat16)
+    try:
+        import intel_extension_for_pytorch as ipex
+    except ImportError:
+        return model
+    transformer = model[0] # The Transformer module wrapping the HF model
+    transformer.auto_model = ipex.optimize(transformer.auto_model.eval(), dtype=torch.bfloat16)
+    return model
+
 @st.cache_resource # Cache the model loading
-def get_embedding_model(model_name):
-    """Loads and returns the SentenceTransformer model."""
+def get_embedding_model(model_name, model_path=None, max_seq_length=None, backend='torch', torch_threads=None,
+                        compile_model=False, onnx_path=None):
+    """Loads and returns the SentenceTransformer model.
+
+    If model_path holds a saved copy it is loaded from disk with no
+    HuggingFace Hub requests; otherwise the model is fetched by name and,
+    when model_path is set, saved there for the next start. The 'onnx-int8'
+    backend runs the encoder through ONNX Runtime with int8 weights instead,
+    exported to (and later loaded from) onnx_path; model_path is not used then.
+    'torch-bf16' keeps torch but with bfloat16 weights.
+    torch_threads caps the threads torch uses for a forward pass, and
+    compile_model runs the torch encoder through torch.compile. A few
+    warmup queries are encoded before the model is returned.
+    """
     # st.info(f"Loading embedding model: {model_name}...") # Quieten UI - happens only once
     try:
-        model = SentenceTransformer(model_name)
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if backend == 'onnx-int8':
+            if not onnx_path:
+                st.error("EMBEDDING_BACKEND 'onnx-int8' requires EMBEDDING_ONNX_PATH to be set.")
+                st.stop()
+            model = load_quantized_onnx_model(model_name, onnx_path)
+        elif model_path and os.path.isdir(model_path):
+            model = SentenceTransformer(model_path, device='cpu', local_files_only=True)
+        else:
+            model = SentenceTransformer(model_name, device='cpu')
+            if model_path:
+                model.save(model_path)
+        if backend == 'torch-bf16':
+            model = convert_to_bfloat16(model)
+        if max_seq_length:
+            model.max_seq_length = max_seq_length
+        if torch_threads and backend != 'onnx-int8':
+            # Torch defaults to one thread per core; for a single query the
+            # fork/join overhead of that many threads outweighs the extra matmul throughput
+            torch.set_num_threads(torch_threads)
+        if compile_model and backend != 'onnx-int8':
+            # Inductor fuses the encoder's elementwise ops (GELU, layer norm, bias adds)
+            # into fewer kernels; dynamic shapes avoid a recompile per query length
+            transformer = model[0] # The Transformer module wrapping the HF model
+            transformer.auto_model = torch.compile(transformer.auto_model, dynamic=True)
+        with torch.inference_mode(): # Same mode as EmbeddingBatcher, so compiled graphs are reused
+            for warmup_query in WARMUP_QUERIES:
+                model.encode([warmup_query], normalize_embeddings=True)
         # dimension = model.get_sentence_embedding_dimension() # Not strictly needed here
         # st.success(f"Model '{model_name}' loaded (Dimension: {dimension}).") # Quieten UI
         # print(f"Model '{model_name}' loaded.") # Quieten console
@@ -49,10 +162,19 @@ def get_embedding_model(model_name):
 
 # --- Initialize Supabase Client (Cached) ---
 @st.cache_resource # Cache the Supabase client
-def init_supabase_client(url, key):
-    """Initializes and returns the Supabase client."""
+def init_supabase_client(url, key, warmup_table=None):
+    """Initializes and returns the Supabase client.
+
+    If warmup_table is given, one tiny select is made against it so the
+    connection (TCP + TLS) is already open when the first search runs.
+    """
     try:
         client = create_client(url, key)
+        if warmup_table:
+            try:
+                client.table(warmup_table).select("section_key").limit(1).execute()
+            except Exception as e: # Warmup is best-effort; real errors surface on search
+                print(f"Supabase warmup request failed: {e}")
         # print("Supabase client initialized.") # Quieten console
         return client
     except Exception as e:
@@ -61,54 +183,208 @@ def init_supabase_client(url, key):
         st.stop()
 
 # --- Embedding Generation ---
-# No caching here as query changes
-def get_query_embedding(query: str, model: SentenceTransformer) -> list[float] | None:
+class EmbeddingBatcher:
+    """Encodes queries from concurrent sessions in shared batches.
+
+    Streamlit runs each browser session's script in its own thread. Queries
+    are handed to a single worker thread, which takes every query that
+    arrives within max_wait of the first (up to max_batch) and encodes them
+    in one forward pass; queries arriving while a batch is encoding form the
+    next one.
+    """
+
+    def __init__(self, model, max_batch=32, max_wait=0.01):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def submit(self, query):
+        """Queues a query; returns a Future resolving to its unit-length embedding."""
+        future = Future()
+        self._queue.put((query, future))
+        return future
+
+    def _next_batch(self):
+        items = [self._queue.get()] # Block until a query arrives
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        import torch # Already loaded with the model
+        while True:
+            items = self._next_batch()
+            try:
+                with torch.inference_mode(): # No autograd bookkeeping for the forward pass
+                    embeddings = self.model.encode(
+                        [query for query, _ in items],
+                        batch_size=len(items),
+                        normalize_embeddings=True
+                    )
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(items, embeddings):
+                future.set_result(embedding)
+
+@st.cache_resource # One batcher (and worker thread) per process, shared by all sessions
+def get_embedding_batcher(_model, max_wait_ms: int) -> EmbeddingBatcher:
+    """Returns the process-wide EmbeddingBatcher for the model."""
+    return EmbeddingBatcher(_model, max_wait=max_wait_ms / 1000)
+
+# Cached per query string: reruns and repeated queries skip the encoder pass.
+# The leading underscore tells Streamlit not to hash the (process-wide) batcher.
+@st.cache_data(max_entries=1024, ttl=3600, show_spinner=False)
+def embed_query(query: str, _batcher: EmbeddingBatcher) -> np.ndarray:
+    """Encodes the query into a unit-length embedding vector."""
+    return _batcher.submit(query).result()
+
+def normalize_query(query: str, lowercase: bool) -> str:
+    """Collapses whitespace (and case, if the tokenizer ignores it) so equivalent
+    queries share one embedding cache entry; the tokens the model sees are unchanged."""
+    query = " ".join(query.split())
+    return query.lower() if lowercase else query
+
+def get_query_embedding(query: str, batcher: EmbeddingBatcher) -> np.ndarray | None:
     """Gets the embedding for the user query."""
     try:
-        embedding = model.encode(query)
-        embedding_list = embedding.tolist()
-        # print(f"Generated query embedding (dimension: {len(embedding_list)}).") # Quieten console
-        return embedding_list
+        embedding = embed_query(normalize_query(query, lowercase_queries), batcher)
+        # print(f"Generated query embedding (dimension: {len(embedding)}).") # Quieten console
+        return embedding
     except Exception as e:
          st.error(f"An unexpected error occurred while getting query embedding: {e}")
          print(f"An unexpected error occurred while getting query embedding: {e}") # Keep error print for server logs
          return None
 
 # --- Supabase Search ---
-# No caching here as query embedding changes
-def search_similar_sections(supabase: Client, search_function: str, query_embedding: list[float], limit: int):
+# Cached briefly: repeating a search (same embedding and limit) skips the RPC,
+# while re-uploaded Acts still show up within a few minutes.
+@st.cache_data(max_entries=256, ttl=300, show_spinner=False)
+def match_sections_rpc(_supabase: Client, search_function: str, query_vector: str, limit: int) -> list[dict]:
+    """Calls the similarity search RPC with a pgvector literal; returns the matched rows.
+
+    RPC errors raise (postgrest APIError), so they are never cached.
+    """
+    match_response = _supabase.rpc(
+        search_function,
+        {
+            'query_embedding': query_vector,
+            'match_threshold': 0.5, # Minimum similarity threshold
+            'match_count': limit
+        }
+    ).execute()
+    return match_response.data or []
+
+def search_similar_sections(supabase: Client, search_function: str, query_embedding: np.ndarray, limit: int):
     """Performs vector similarity search using the specified RPC function."""
     try:
-        match_response = supabase.rpc(
-            search_function,
-            {
-                'query_embedding': query_embedding,
-                'match_threshold': 0.5, # Minimum similarity threshold
-                'match_count': limit
-            }
-        ).execute()
-
-        if hasattr(match_response, 'data') and match_response.data:
-            # print(f"Found {len(match_response.data)} potentially relevant sections.") # Quieten console
-            return match_response.data
-        else:
-            if hasattr(match_response, 'error') and match_response.error:
-                 st.warning(f"Supabase RPC error: {match_response.error}")
-                 print(f"Supabase RPC error: {match_response.error}") # Keep error print for server logs
-            return []
+        matches = match_sections_rpc(supabase, search_function, json_utils.format_pgvector(query_embedding), limit)
+        # print(f"Found {len(matches)} potentially relevant sections.") # Quieten console
+        return matches
     except Exception as e:
         st.error(f"Error during similarity search RPC call: {e}")
         print(f"Error during similarity search RPC call: {e}") # Keep error print for server logs
         return []
 
+# --- Section HTML (loaded on demand) ---
+@st.cache_data(max_entries=256, ttl=3600, show_spinner=False)
+def fetch_section_html(_supabase: Client, table_name: str, section_key: str) -> str | None:
+    """Fetches one section's HTML by its key."""
+    response = _supabase.table(table_name).select('html_content').eq('section_key', section_key).limit(1).execute()
+    return response.data[0].get('html_content') if response.data else None
+
+@st.cache_resource # Shared by all sessions; the fetches only do network I/O
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """Returns the process-wide thread pool for background HTML fetches."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="html-prefetch")
+
+def fetch_sections_html(supabase: Client, table_name: str, section_keys: list[str]) -> dict:
+    """Fetches the HTML of several sections in one query; returns it by section_key.
+
+    Runs on a prefetch thread, so it makes no Streamlit calls.
+    """
+    response = supabase.table(table_name).select('section_key,html_content').in_('section_key', section_keys).execute()
+    return {row['section_key']: row.get('html_content') for row in response.data or []}
+
+def prefetch_section_html(supabase: Client, table_name: str, sections: list[dict]) -> Future | None:
+    """Starts fetching the HTML the RPC rows left out, for all results at once.
+
+    The query runs while the results are rendered and read, so "Show full
+    text" usually finds the HTML already loaded. Returns None if every row
+    already has its HTML.
+    """
+    section_keys = [section['section_key'] for section in sections if section.get('html_content') is None]
+    if not section_keys:
+        return None
+    return get_prefetch_executor().submit(fetch_sections_html, supabase, table_name, section_keys)
+
+def get_section_html(supabase: Client, table_name: str, section: dict, prefetched: Future | None = None) -> str | None:
+    """Returns a result's HTML: from the RPC row if included, else from the
+    prefetch started with the search, else fetched by key."""
+    if section.get('html_content') is not None:
+        return section['html_content']
+    if prefetched is not None:
+        try:
+            html_by_key = prefetched.result()
+        except Exception as e: # Fall back to the single-section query below
+            print(f"HTML prefetch failed: {e}")
+            html_by_key = {}
+        if section.get('section_key') in html_by_key:
+            return html_by_key[section['section_key']]
+    try:
+        return fetch_section_html(supabase, table_name, section.get('section_key'))
+    except Exception as e:
+        st.error(f"Error loading section content: {e}")
+        print(f"Error loading section content: {e}") # Keep error print for server logs
+        return None
+
+# --- Result Display ---
+def build_result_rows(sections: list[dict]) -> list[tuple]:
+    """Formats each result's summary once per search.
+
+    Returns (section, summary) tuples; summary is the result's title, key
+    line and text preview as one markdown string (preceded by a rule for all
+    but the first result). They are kept in session state, so reruns (e.g. a
+    "Show full text" toggle) skip the per-field lookups and string building
+    for every result.
+    """
+    rows = []
+    for i, section in enumerate(sections):
+        section_key = section.get('section_key', 'N/A')
+        structure_type = section.get('structure_type', '')
+        full_id = section.get('full_id', '')
+        similarity = section.get('similarity', 0.0)
+        heading = section.get('heading_text', '') # heading_text comes straight from Supabase
+        # Title built from structure_type, full_id and heading_text
+        title = f"{structure_type} {full_id} {heading}".strip().translate(MARKDOWN_ESCAPES)
+        text_content = section.get('text_content') or ''
+        # Statute text is plain text, not markdown (the title is escaped the same way)
+        preview = text_content[:500].translate(MARKDOWN_ESCAPES) + ('...' if len(text_content) > 500 else '')
+        summary = (
+            ("---\n\n" if i else "")
+            + f"**{i+1}. {title}** (Similarity: {similarity:.4f})\n\n"
+            f"**Key:** `{section_key}` | **Type:** `{structure_type}` | **ID:** `{full_id}`\n\n"
+            f"{preview}"
+        )
+        rows.append((section, summary))
+    return rows
+
 # === Main App Logic ===
 
 # 1. Load Configuration
 config = load_app_config()
+validate_config(config)
 
-# 2. Initialize Model and Client (will be cached after first run)
-model = get_embedding_model(config["embedding_model_name"])
-supabase_client = init_supabase_client(config["supabase_url"], config["supabase_key"])
+# 2. Initialize Client (will be cached after first run)
+supabase_client = init_supabase_client(config["supabase_url"], config["supabase_key"], config["sections_table"])
 
 # 3. Authentication Check (Existing Logic)
 if 'user' not in st.session_state:
@@ -152,35 +428,45 @@ if not user_email.endswith(f"@{allowed_domain}"):
     st.error(f"🚫 Access denied. You must use a @{allowed_domain} email address.")
     st.stop()
 
+# 6. Initialize Model (will be cached after first run)
+# Loaded only once a permitted user is signed in, so the login page renders
+# without waiting for torch to import or the model to load
+model = get_embedding_model(
+    config["embedding_model_name"],
+    config["embedding_model_path"],
+    config["embedding_max_seq_length"],
+    config["embedding_backend"],
+    config["torch_threads"],
+    config["embedding_compile"],
+    config["embedding_onnx_path"]
+)
+embedding_batcher = get_embedding_batcher(model, config["embedding_batch_wait_ms"])
+# Uncased tokenizers (e.g. BGE's) make query case irrelevant to the embedding
+lowercase_queries = bool(getattr(getattr(model, 'tokenizer', None), 'do_lower_case', False))
+
 # --- Main App Content Area ---
 st.title("📚 Legislative Document Search")
 st.markdown(f"Powered by `{config['embedding_model_name']}`")
 
 # CSS Injection (Keep as is)
-table_override_css = """
-<style>
-    div[data-testid="stMarkdownContainer"] table {
-        width: 100% !important; table-layout: auto !important; border-collapse: collapse;
-    }
-    div[data-testid="stMarkdownContainer"] table th,
-    div[data-testid="stMarkdownContainer"] table td {
-        width: auto !important; border: 1px solid #ccc; padding: 6px; text-align: left; vertical-align: top;
-    }
-</style>
-"""
-st.markdown(table_override_css, unsafe_allow_html=True)
+# Emitted on every run: Streamlit drops elements a rerun doesn't redraw
+# SECTION_CSS styles the heading/indent classes in the stored section HTML
+st.markdown(f"{TABLE_OVERRIDE_CSS}<style>{SECTION_CSS}</style>", unsafe_allow_html=True)
 
-# Search Input
-search_query = st.text_input("Enter your search query:", placeholder="e.g., definition of resident for tax purposes")
+# Search Input and Button
+# In a form, editing the query doesn't rerun the script; only submitting does
+with st.form("search_form", border=False):
+    search_query = st.text_input("Enter your search query:", placeholder="e.g., definition of resident for tax purposes")
+    search_submitted = st.form_submit_button("🔍 Search", type="primary")
 
-# Search Button and Results Area
-if st.button("🔍 Search", type="primary"):
+# Search Results Area
+if search_submitted:
     if search_query:
         # Keep spinners as they provide user feedback
         with st.spinner("Generating query embedding..."):
-            query_embedding = get_query_embedding(search_query, model)
+            query_embedding = get_query_embedding(search_query, embedding_batcher)
 
-        if query_embedding:
+        if query_embedding is not None:
             with st.spinner(f"Searching for relevant sections in Supabase..."):
                 similar_sections = search_similar_sections(
                     supabase_client,
@@ -188,40 +474,40 @@ if st.button("🔍 Search", type="primary"):
                     query_embedding,
                     config["search_limit"]
                 )
-
-            st.subheader("Search Results")
-            if similar_sections:
-                # Display results using correct logic
-                for i, section in enumerate(similar_sections):
-                    section_key = section.get('section_key', 'N/A')
-                    structure_type = section.get('structure_type', '')
-                    full_id = section.get('full_id', '')
-                    similarity = section.get('similarity', 0.0)
-                    html_content = section.get('html_content', '<p>HTML content not available.</p>')
-                    # --- Use heading_text directly from Supabase ---
-                    heading = section.get('heading_text', '') # Get heading text
-                    # Construct the label using structure_type, full_id, and heading_text
-                    expander_title = f"{structure_type} {full_id} {heading}".strip()
-                    expander_label = f"**{i+1}. {expander_title}** (Similarity: {similarity:.4f})"
-                    # --- End Label Construction ---
-
-                    # Use an expander for each result with the structured title
-                    with st.expander(expander_label):
-                        st.markdown(f"**Key:** `{section_key}` | **Type:** `{structure_type}` | **ID:** `{full_id}`")
-                        st.markdown("---")
-                        # --- Display HTML Content ---
-                        st.markdown(html_content, unsafe_allow_html=True)
-                        # --- End HTML Display ---
-            else:
-                # Keep this message for user feedback
-                st.info("No relevant sections found matching your query and threshold.")
+            # Kept across reruns, so showing a result's full text doesn't discard the results
+            st.session_state['search_results'] = build_result_rows(similar_sections)
+            st.session_state['html_prefetch'] = prefetch_section_html(
+                supabase_client, config["sections_table"], similar_sections
+            )
         else:
-             # Keep error message for user feedback
+            st.session_state['search_results'] = None
+            st.session_state['html_prefetch'] = None
+            # Keep error message for user feedback
             st.error("Failed to generate embedding for the query.")
     else:
          # Keep warning message for user feedback
         st.warning("Please enter a search query.")
 
+result_rows = st.session_state.get('search_results')
+if result_rows is not None:
+    st.subheader("Search Results")
+    if result_rows:
+        for i, (section, summary) in enumerate(result_rows):
+            # Title, key line and preview in one element: each st.* call is a
+            # separate delta to the browser
+            st.markdown(summary)
+            # --- Display HTML Content ---
+            # The (often large) HTML is only loaded and sent once asked for
+            if st.toggle("Show full text", key=f"show_html_{i}_{section.get('section_key', 'N/A')}"):
+                html_content = get_section_html(
+                    supabase_client, config["sections_table"], section, st.session_state.get('html_prefetch')
+                )
+                st.markdown(html_content or '<p>HTML content not available.</p>', unsafe_allow_html=True)
+            # --- End HTML Display ---
+    else:
+        # Keep this message for user feedback
+        st.info("No relevant sections found matching your query and threshold.")
+
 # Footer
 st.markdown("---")
 st.caption("Internal Search Tool")
@@ -19,6 +19,14 @@ pip install --upgrade pip
 echo "Installing requirements..."
 pip install -r requirements.txt
 
-# Step 5: Done
+# Step 5: Save the embedding model locally (optional)
+# With EMBEDDING_MODEL_PATH set, app.py loads the model from this directory
+# instead of contacting the HuggingFace Hub on every start.
+if [ -n "$EMBEDDING_MODEL_PATH" ]; then
+    echo "Saving embedding model to $EMBEDDING_MODEL_PATH..."
+    python -c "import os, sys; from sentence_transformers import SentenceTransformer; SentenceTransformer(os.getenv('EMBEDDING_MODEL', 'BAAI/bge-large-en-v1.5')).save(sys.argv[1])" "$EMBEDDING_MODEL_PATH"
+fi
+
+# Step 6: Done
 echo "✅ Virtual environment is ready and requirements are installed."
 echo "To activate it later, run: source venv/bin/activate"
\ No newline at end of file
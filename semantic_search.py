@@ -1,8 +1,12 @@
 import os
+import functools
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import json # For pretty printing results
 import sys
+import numpy as np
+import json_utils
+from embedding_utils import load_quantized_onnx_model
 from sentence_transformers import SentenceTransformer # Import for local embeddings
 
 # --- Configuration Loading ---
@@ -13,9 +17,12 @@ def load_config():
         "supabase_url": os.getenv("SUPABASE_URL"),
         "supabase_key": os.getenv("SUPABASE_KEY"), # Use Anon or Service key
         "sections_table": "sections", # Hardcode our table name
-        "search_function": "match_sections", # The SQL function we created
+        "search_function": os.getenv("SEARCH_FUNCTION", "match_sections"), # The SQL function we created (match_sections_ip: inner product, see below)
         "embedding_model": os.getenv("EMBEDDING_MODEL", 'BAAI/bge-large-en-v1.5'),
+        "embedding_backend": os.getenv("EMBEDDING_BACKEND", "torch"), # 'onnx-int8': quantized ONNX Runtime encoder
+        "embedding_onnx_path": os.getenv("EMBEDDING_ONNX_PATH"), # Where the int8 ONNX export is kept (required for onnx-int8)
         "search_limit": int(os.getenv("SEARCH_LIMIT", 5)), # Default to top 5
+        "query_max_seq_len": int(os.getenv("QUERY_MAX_SEQ_LEN", 128)), # Longer queries are truncated
         # pgvector_dimension is derived from the model later
     }
     if not all([config["supabase_url"], config["supabase_key"]]):
@@ -26,10 +33,21 @@ def load_config():
 
 # --- Initialize Embedding Model ---
 # Load model globally to avoid reloading in the loop
-def initialize_embedding_model(model_name):
-    print(f"Loading embedding model: {model_name}...")
+def initialize_embedding_model(model_name, backend='torch', onnx_path=None, max_seq_length=None):
+    print(f"Loading embedding model: {model_name} (backend: {backend})...")
     try:
-        model = SentenceTransformer(model_name)
+        if backend == 'onnx-int8':
+            if not onnx_path:
+                print("Error: EMBEDDING_BACKEND 'onnx-int8' requires EMBEDDING_ONNX_PATH to be set.")
+                sys.exit(1)
+            model = load_quantized_onnx_model(model_name, onnx_path)
+        else:
+            model = SentenceTransformer(model_name)
+        if max_seq_length:
+            # Bounds attention cost for long inputs; queries are only embedded here, never sections
+            model.max_seq_length = max_seq_length
+        # Warm up before the prompt appears rather than on the first query
+        model.encode("warmup", normalize_embeddings=True)
         dimension = model.get_sentence_embedding_dimension()
         print(f"Model loaded successfully. Embedding dimension: {dimension}")
         return model, dimension
@@ -39,21 +57,26 @@ def initialize_embedding_model(model_name):
 
 
 # --- Embedding Generation ---
-def get_query_embedding(query: str, model: SentenceTransformer) -> list[float] | None:
+@functools.lru_cache(maxsize=2048)
+def encode_query(query: str, model: SentenceTransformer) -> np.ndarray:
+    """Encodes a (whitespace-normalized) query; repeated queries reuse the result."""
+    # Unit length, so the inner-product RPC (match_sections_ip) ranks exactly like cosine
+    return model.encode(query, normalize_embeddings=True)
+
+def get_query_embedding(query: str, model: SentenceTransformer) -> np.ndarray | None:
     """Gets the embedding for the user query using the local SentenceTransformer model."""
     try:
         print(f"Generating embedding for query...")
-        embedding = model.encode(query)
-        # Ensure it's a list of floats for Supabase
-        embedding_list = embedding.tolist()
-        print(f"Generated query embedding (dimension: {len(embedding_list)}).")
-        return embedding_list
+        # The tokenizer splits on whitespace, so collapsing it doesn't change the embedding
+        embedding = encode_query(" ".join(query.split()), model)
+        print(f"Generated query embedding (dimension: {len(embedding)}).")
+        return embedding
     except Exception as e:
          print(f"An unexpected error occurred while getting query embedding: {e}")
          return None
 
 # --- Supabase Search ---
-def search_similar_sections(supabase: Client, search_function: str, query_embedding: list[float], limit: int):
+def search_similar_sections(supabase: Client, search_function: str, query_embedding: np.ndarray, limit: int):
     """Performs vector similarity search using the specified RPC function."""
     try:
         print(f"Searching for similar sections using RPC function '{search_function}'...")
@@ -61,7 +84,7 @@ def search_similar_sections(supabase: Client, search_function: str, query_embedd
         match_response = supabase.rpc(
             search_function,
             {
-                'query_embedding': query_embedding,
+                'query_embedding': json_utils.format_pgvector(query_embedding),
                 'match_threshold': 0.5, # Minimum similarity threshold (adjust lower if needed)
                 'match_count': limit
             }
@@ -91,7 +114,12 @@ def main():
     config = load_config()
 
     # Initialize Embedding Model
-    model, pgvector_dimension = initialize_embedding_model(config["embedding_model"])
+    model, pgvector_dimension = initialize_embedding_model(
+        config["embedding_model"],
+        config["embedding_backend"],
+        config["embedding_onnx_path"],
+        config["query_max_seq_len"]
+    )
 
     # Initialize Supabase Client
     try:
@@ -118,7 +146,7 @@ def main():
 
         # 1. Get Query Embedding (using local model)
         query_embedding = get_query_embedding(query, model)
-        if not query_embedding:
+        if query_embedding is None:
             print("Could not get embedding for query. Please try again.")
             continue
 
@@ -208,4 +236,149 @@ AS $$
     match_count;
 $$;
 
+-- =================================================================== --
+-- OPTIONAL Inner-Product Search over 'sections' (SEARCH_FUNCTION=match_sections_ip)
+-- =================================================================== --
+-- Stored and query embeddings are L2-normalized (normalize_embeddings=True),
+-- so the inner product equals cosine similarity and pgvector can skip the
+-- per-row norm computation that `<=>` performs. `<#>` returns the NEGATIVE
+-- inner product, hence the sign flip; match_threshold keeps its meaning.
+-- ORDER BY uses the operator itself so the HNSW index below can serve it.
+-- html_content is not returned: the search UI fetches it by section_key
+-- only for results whose full text is displayed, and main.api.py reads it
+-- for a whole result page in one `section_key IN (...)` select.
+
+CREATE INDEX IF NOT EXISTS sections_embedding_ip_idx
+  ON sections USING hnsw (embedding vector_ip_ops);
+
+CREATE OR REPLACE FUNCTION match_sections_ip (
+  query_embedding vector,
+  match_threshold double precision,
+  match_count integer
+)
+RETURNS TABLE (
+  section_key text,
+  structure_type text,
+  full_id text,
+  text_content text,
+  heading_text text,
+  similarity double precision
+)
+LANGUAGE sql STABLE
+AS $$
+  SELECT
+    s.section_key,
+    s.structure_type,
+    s.full_id,
+    s.text_content,
+    s.heading_text,
+    -(s.embedding <#> query_embedding) as similarity
+  FROM
+    sections s
+  WHERE -(s.embedding <#> query_embedding) > match_threshold
+  ORDER BY
+    s.embedding <#> query_embedding
+  LIMIT
+    match_count;
+$$;
+
+-- =================================================================== --
+-- OPTIONAL Half-Precision Search (SEARCH_FUNCTION=match_sections_halfvec)
+-- =================================================================== --
+-- Requires pgvector 0.7+. Same as match_sections_ip, but the HNSW index
+-- holds the embeddings as halfvec (FP16) via an expression index: half the
+-- index size and memory traffic per distance computation, while the stored
+-- vector column and the upload path stay as they are. 1024 is the
+-- bge-large-en-v1.5 dimension. Clients keep sending the float32 literal;
+-- it is rounded to halfvec on input.
+
+CREATE INDEX IF NOT EXISTS sections_embedding_halfvec_ip_idx
+  ON sections USING hnsw ((embedding::halfvec(1024)) halfvec_ip_ops);
+
+CREATE OR REPLACE FUNCTION match_sections_halfvec (
+  query_embedding halfvec(1024),
+  match_threshold double precision,
+  match_count integer
+)
+RETURNS TABLE (
+  section_key text,
+  structure_type text,
+  full_id text,
+  text_content text,
+  heading_text text,
+  similarity double precision
+)
+LANGUAGE sql STABLE
+AS $$
+  SELECT
+    s.section_key,
+    s.structure_type,
+    s.full_id,
+    s.text_content,
+    s.heading_text,
+    -(s.embedding::halfvec(1024) <#> query_embedding) as similarity
+  FROM
+    sections s
+  WHERE -(s.embedding::halfvec(1024) <#> query_embedding) > match_threshold
+  ORDER BY
+    s.embedding::halfvec(1024) <#> query_embedding
+  LIMIT
+    match_count;
+$$;
+
+-- =================================================================== --
+-- OPTIONAL Quantized Search with Re-ranking (SEARCH_FUNCTION=match_sections_rerank)
+-- =================================================================== --
+-- Requires pgvector 0.7+. pgvector has no int8 vector type; its compact
+-- option is binary quantization (one bit per dimension, 128 bytes per row
+-- for 1024 dims instead of 4 KB). The HNSW index below is built on that
+-- bit expression, so the stored column is unchanged and needs no backfill.
+-- Stage 1 takes the rerank_candidates nearest rows by Hamming distance on
+-- the quantized vectors; stage 2 re-ranks only those rows by the exact
+-- inner product on the float32 embeddings, so reported similarities are
+-- the same as match_sections_ip. hnsw.ef_search must be at least the
+-- candidate count or the index returns fewer rows.
+
+CREATE INDEX IF NOT EXISTS sections_embedding_bit_idx
+  ON sections USING hnsw ((binary_quantize(embedding)::bit(1024)) bit_hamming_ops);
+
+CREATE OR REPLACE FUNCTION match_sections_rerank (
+  query_embedding vector(1024),
+  match_threshold double precision,
+  match_count integer,
+  rerank_candidates integer DEFAULT 200
+)
+RETURNS TABLE (
+  section_key text,
+  structure_type text,
+  full_id text,
+  text_content text,
+  heading_text text,
+  similarity double precision
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 200
+AS $$
+  SELECT
+    c.section_key,
+    c.structure_type,
+    c.full_id,
+    c.text_content,
+    c.heading_text,
+    -(c.embedding <#> query_embedding) as similarity
+  FROM (
+    SELECT s.section_key, s.structure_type, s.full_id, s.text_content, s.heading_text, s.embedding
+    FROM sections s
+    ORDER BY
+      binary_quantize(s.embedding)::bit(1024) <~> binary_quantize(query_embedding)
+    LIMIT
+      rerank_candidates
+  ) c
+  WHERE -(c.embedding <#> query_embedding) > match_threshold
+  ORDER BY
+    c.embedding <#> query_embedding
+  LIMIT
+    match_count;
+$$;
+
 """ 
\ No newline at end of file
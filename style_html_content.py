@@ -3,41 +3,26 @@ import sys
 import os
 import json
 import logging
-import re
-from bs4 import BeautifulSoup, Tag
-
-# Basic Logging Setup
-log_file = 'style_html.log'
-# Ensure the logs directory exists
-log_dir = os.path.dirname(log_file)
-if log_dir and not os.path.exists(log_dir):
-    try:
-        os.makedirs(log_dir)
-    except OSError as e:
-        print(f"Could not create log directory '{log_dir}': {e}", file=sys.stderr)
+import json_utils
+from concurrent.futures import ProcessPoolExecutor
+from lxml import html as lxml_html
 
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[logging.FileHandler(log_file, mode='w'), logging.StreamHandler()])
+# Worker processes for the standalone script. Serial by default; set
+# STYLE_WORKERS (e.g. to the CPU count) to style large files in parallel.
+# process_act.py calls transform_dict() serially: it already runs one
+# process per file.
+DEFAULT_STYLE_WORKERS = 1
+STYLE_CHUNKSIZE = 64 # Sections per task sent to a worker, to amortize pickling/IPC
 
-def style_section_html(html_string: str, heading_text: str) -> str:
-    """
-    Applies basic styling to the HTML content of a section.
-    Currently: Identifies headings by looking for <p> tags containing <a> with id attributes.
-    Also adds indentation for numbered and lettered lists.
-    """
-    if not html_string:
-        return html_string # Return original if no content
+# --- Logging Setup ---
+# Basic configuration will be done in the main block (this module is also
+# imported in-process by process_act.py)
+# --- End Logging Setup ---
 
-    try:
-        soup = BeautifulSoup(html_string, 'html.parser')
-        
-        # --- Add CSS for Headings and Indentation ---
-        # Create a style tag if it doesn't exist
-        style_tag = soup.find('style')
-        if not style_tag:
-            style_tag = soup.new_tag('style')
-            style_tag.string = """
+# Rules for the classes added by style_section_html. Sections are stored as
+# markup only; renderers include this once per page. The search UI imports it
+# and main.api.py serves it as GET /section.css
+SECTION_CSS = """
                 .legislation-heading { font-weight: bold; }
                 p.indent-level-1 { 
                     margin-left: 0 !important; 
@@ -55,179 +40,262 @@ def style_section_html(html_string: str, heading_text: str) -> str:
                     text-indent: 0 !important;
                 }
             """
-            # Add to the beginning of the document
-            if soup.contents:
-                soup.insert(0, style_tag)
-            else:
-                soup.append(style_tag)
-                
-        # --- Find Headings by <a> with id ---
+
+# libxml2 silently empties text and attribute values over 10 MB (e.g. large
+# base64 data: URI images) unless huge_tree is set
+_HTML_PARSER = lxml_html.HTMLParser(huge_tree=True)
+
+# Roman numeral list markers (matched case-insensitively)
+ROMAN_MARKERS = frozenset([
+    'i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x', 'xi', 'xii',
+    'xiii', 'xiv', 'xv', 'xvi', 'xvii', 'xviii', 'xix', 'xx', 'xxi', 'xxii', 'xxiii'
+])
+
+def list_marker_token(text):
+    """Returns the token of a leading '(...)' list marker, e.g. '1', 'a' or 'iv'.
+
+    text must already be stripped. Returns None if it doesn't start with a
+    bracketed token. Plain slicing and set lookups, rather than a regex, as
+    this runs for every paragraph.
+    """
+    if not text.startswith('('):
+        return None
+    close = text.find(')', 1)
+    if close <= 1:
+        return None
+    return text[1:close]
+
+def is_letter_marker(token):
+    """True for a single lowercase letter token, including i, v and x."""
+    return token is not None and len(token) == 1 and 'a' <= token <= 'z'
+
+def add_class(element, class_name):
+    """Appends class_name to the element's class attribute.
+
+    Each styled <p> gets exactly one class from this module, and mammoth
+    output rarely has one already, so the usual case is a single attribute
+    write with no list building. A class that is already present is not
+    added again, so styling a section twice changes nothing.
+    """
+    existing = element.get('class')
+    if existing:
+        classes = existing.split()
+        if class_name not in classes:
+            element.set('class', ' '.join(classes + [class_name]))
+    else:
+        element.set('class', class_name)
+
+def style_section_html(html_string: str) -> str:
+    """
+    Applies basic styling to the HTML content of a section by adding the
+    classes styled in SECTION_CSS (the stylesheet itself is not embedded).
+    Currently: Identifies headings by looking for <p> tags containing <a> with id attributes.
+    Also adds indentation for numbered and lettered lists.
+    The fragment is parsed and serialized with lxml, and its <p> tags are
+    classified in one traversal (ambiguous '(i)' items are resolved after it).
+    """
+    if not html_string:
+        return html_string # Return original if no content
+    # Only <p> tags get classes, so sections without any are returned unparsed
+    # (a bare '<p' test would also match <pre>, <param>, <path>, ...)
+    if '<p>' not in html_string and '<p ' not in html_string:
+        return html_string
+
+    try:
+        # Wrapped in a <div> so leading/trailing text and several top-level tags parse as one tree
+        root = lxml_html.fragment_fromstring(html_string, create_parent='div', parser=_HTML_PARSER)
+
         headings_found = 0
-        
-        # Look for paragraphs containing anchor tags with id attributes
-        for p_tag in soup.find_all('p'):
-            a_tags_with_id = p_tag.find_all('a', id=True)
-            if a_tags_with_id:
+        indent_count = {
+            'level1': 0,
+            'level2': 0,
+            'level3': 0
+        }
+        needs_context = [] # Indices of ambiguous (i) items
+
+        # Single pass over the paragraphs: headings and clear list items are
+        # styled as they are reached. Every paragraph's list marker is kept
+        # for the neighbour checks on the ambiguous (i) items afterwards.
+        p_tags = []
+        p_markers = []
+        for i, p_tag in enumerate(root.iter('p')):
+            p_text = p_tag.text_content().strip()
+            token = list_marker_token(p_text)
+            p_tags.append(p_tag)
+            p_markers.append(token)
+
+            # --- Find Headings by <a> with id ---
+            # find() stops at the first anchor; only its presence matters
+            if p_tag.find('.//a[@id]') is not None:
                 # This is a heading paragraph - add our class
-                p_tag['class'] = p_tag.get('class', []) + ['legislation-heading']
+                add_class(p_tag, 'legislation-heading')
                 headings_found += 1
-                logging.debug(f"Found heading: {p_tag.get_text()[:50]}...")
-        
-        # --- Process Indentation for Lists ---
-        # Patterns for different list types
-        number_pattern = re.compile(r'^\s*\(\d+\)')  # (1), (2), ...
-        letter_pattern = re.compile(r'^\s*\(([a-z])\)')  # Now matches all letters (a)-(z)
-        roman_pattern = re.compile(r'^\s*\((i{1,3}|iv|v|vi{1,3}|ix|x|xi{1,3}|xiv|xv|xvi{1,3}|xix|xx|xxi{1,3})\)', re.IGNORECASE)
-        
+                logging.debug("Found heading: %.50s...", p_text)
+                continue
+
+            # --- Process Indentation for Lists ---
+            if token is None:
+                continue
+
+            # Remember (i) items so we can analyze them further
+            if token == 'i':
+                needs_context.append(i)
+
+            # Handle all other cases immediately
+            elif token.isdecimal(): # (1), (2), ...
+                add_class(p_tag, 'indent-level-1')
+                indent_count['level1'] += 1
+            elif token.lower() in ROMAN_MARKERS:
+                # Clear Roman numerals like (ii), (iii), (v), (IV)
+                add_class(p_tag, 'indent-level-3')
+                indent_count['level3'] += 1
+            elif is_letter_marker(token):
+                # Letters that could also be Roman numerals were caught above
+                add_class(p_tag, 'indent-level-2')
+                indent_count['level2'] += 1
+
         # Context analysis for differentiating between letter (i) and Roman numeral (i)
-        def is_likely_letter_sequence(p_tags, current_index):
+        def is_likely_letter_sequence(current_index):
             """Determine if a tag is likely part of a letter sequence by checking surrounding tags"""
             if current_index <= 0 or current_index >= len(p_tags) - 1:
                 return False
-            
+
             # Check if previous tag has (h) and next tag has (j)
-            prev_text = p_tags[current_index-1].get_text().strip()
-            next_text = p_tags[current_index+1].get_text().strip()
-            
-            prev_is_h = re.match(r'^\s*\(h\)', prev_text)
-            next_is_j = re.match(r'^\s*\(j\)', next_text)
-            
-            # If surrounded by h and j, likely a letter
-            if prev_is_h and next_is_j:
-                return True
-                
-            # Also check for other surrounding letter patterns (a)-(z) excluding i,v,x
-            prev_letter_match = re.match(r'^\s*\(([a-z])\)', prev_text)
-            next_letter_match = re.match(r'^\s*\(([a-z])\)', next_text)
-            
-            if prev_letter_match and next_letter_match:
-                prev_letter = prev_letter_match.group(1)
-                next_letter = next_letter_match.group(1)
-                # If there's a clear alphabetical sequence
+            prev_letter = p_markers[current_index-1]
+            next_letter = p_markers[current_index+1]
+
+            if is_letter_marker(prev_letter) and is_letter_marker(next_letter):
+                # Surrounded by (h) and (j), or any other clear alphabetical sequence
                 if ord(next_letter) - ord(prev_letter) == 2:
                     return True
-            
+
             return False
-        
-        # Process paragraphs for indentation
-        p_tags = soup.find_all('p')
-        indent_count = {
-            'level1': 0,
-            'level2': 0,
-            'level3': 0
-        }
-        
-        # First pass: process clear items
-        for i, p_tag in enumerate(p_tags):
-            p_text = p_tag.get_text().strip()
-            
-            # Skip tags that are already identified as headings
-            if p_tag.get('class') and 'legislation-heading' in p_tag.get('class'):
-                continue
-            
-            # Set a special data attribute for (i) items so we can analyze them further
-            if re.match(r'^\s*\(i\)', p_text):
-                p_tag['data-needs-context'] = 'true'
-                
-            # Handle all other cases immediately
-            elif number_pattern.match(p_text):
-                p_tag['class'] = p_tag.get('class', []) + ['indent-level-1']
-                indent_count['level1'] += 1
-            elif letter_pattern.match(p_text) and not roman_pattern.match(p_text):
-                # This will catch all letters except those that could also be Roman numerals
-                p_tag['class'] = p_tag.get('class', []) + ['indent-level-2']
+
+        # Second pass: resolve ambiguous (i) cases
+        for i in needs_context:
+            # Use context to determine if it's a letter or roman numeral
+            if is_likely_letter_sequence(i):
+                add_class(p_tags[i], 'indent-level-2')  # Letter (i)
                 indent_count['level2'] += 1
-            elif roman_pattern.match(p_text) and not p_text.strip().startswith('(i)'):
-                # This will catch clear Roman numerals like (ii), (iii), etc.
-                p_tag['class'] = p_tag.get('class', []) + ['indent-level-3']
+                logging.debug("Identified ambiguous (i) as LETTER based on context")
+            else:
+                add_class(p_tags[i], 'indent-level-3')  # Roman (i)
                 indent_count['level3'] += 1
-        
-        # Second pass: resolve ambiguous (i) cases
-        for i, p_tag in enumerate(p_tags):
-            if p_tag.get('data-needs-context'):
-                # Use context to determine if it's a letter or roman numeral
-                if is_likely_letter_sequence(p_tags, i):
-                    p_tag['class'] = p_tag.get('class', []) + ['indent-level-2']  # Letter (i)
-                    indent_count['level2'] += 1
-                    logging.debug(f"Identified ambiguous (i) as LETTER based on context")
-                else:
-                    p_tag['class'] = p_tag.get('class', []) + ['indent-level-3']  # Roman (i)
-                    indent_count['level3'] += 1
-                    logging.debug(f"Identified ambiguous (i) as ROMAN NUMERAL (default)")
-                
-                # Clean up the temporary attribute
-                del p_tag['data-needs-context']
-
-        logging.debug(f"Applied heading styling to {headings_found} tags")
-        logging.debug(f"Applied indentation: Level 1: {indent_count['level1']}, Level 2: {indent_count['level2']}, Level 3: {indent_count['level3']}")
+                logging.debug("Identified ambiguous (i) as ROMAN NUMERAL (default)")
+
+        # Lazy %-formatting: these run per section, and debug is normally off
+        logging.debug("Applied heading styling to %d tags", headings_found)
+        logging.debug("Applied indentation: Level 1: %d, Level 2: %d, Level 3: %d",
+                      indent_count['level1'], indent_count['level2'], indent_count['level3'])
 
         if headings_found == 0 and sum(indent_count.values()) == 0:
             logging.warning(f"No headings or indentable content found in the HTML content")
 
-        return str(soup)
+        # Serialize, then strip the wrapper's '<div>' and '</div>'
+        return lxml_html.tostring(root, encoding='unicode')[5:-6]
 
     except Exception as e:
         logging.error(f"Error processing HTML for styling: {e}")
         return html_string # Return original on error
 
-def process_json_file(input_filepath, output_filepath):
-    """Loads input JSON, applies styling to HTML, saves to output JSON."""
-    logging.info(f"--- Starting HTML Styling --- ")
-    logging.info(f"Loading data from {input_filepath}...")
-    try:
-        with open(input_filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        logging.error(f"Input file not found: {input_filepath}")
-        print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
-        return False
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding JSON: {e}")
-        print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
-        return False
-    except Exception as e:
-        logging.error(f"Error reading input file: {e}")
-        print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
-        return False
+def _init_style_worker(log_level):
+    """Process pool initializer: gives spawned workers a console log handler.
 
-    if not isinstance(data, dict):
-         logging.error("Input JSON is not a dictionary.")
-         print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
-         return False
+    Forked workers inherit the parent's handlers and are left as they are.
+    """
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def transform_dict(data, workers=1):
+    """Applies styling to the HTML of every section. Returns a new dictionary
+    (sections whose HTML is unchanged are shared with data, not copied).
 
+    With workers > 1 the sections are styled in that many processes
+    (each section is independent); results are merged in input order.
+    Identical HTML (repeated notes, boilerplate clauses) is styled once.
+    """
     logging.info(f"Processing {len(data)} sections...")
+    styled_by_html = {}
+    if workers > 1:
+        # Distinct HTML strings, in first-seen order
+        html_strings = list(dict.fromkeys(
+            section_data["html"] for section_data in data.values()
+            if isinstance(section_data, dict) and section_data.get("html")
+        ))
+        if len(html_strings) > STYLE_CHUNKSIZE: # Smaller inputs don't repay the process start-up
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_style_worker,
+                                     initargs=(logging.getLogger().getEffectiveLevel(),)) as executor:
+                styled = executor.map(style_section_html, html_strings, chunksize=STYLE_CHUNKSIZE)
+                styled_by_html = dict(zip(html_strings, styled))
     processed_data = {} # Create a new dict for results
     processed_count = 0
     styled_count = 0
     for key, section_data in data.items():
         processed_count +=1
-        # Create a copy to avoid modifying the original dict if needed elsewhere
-        updated_section_data = section_data.copy() 
+        # Unchanged sections are reused as they are; a changed one becomes a
+        # new dict, so the input sections are never modified
+        processed_data[key] = section_data
 
         if isinstance(section_data, dict) and "html" in section_data:
             original_html = section_data.get("html", "")
-            heading = section_data.get("heading_text", "")
-            
+
             if original_html:
-                 logging.debug(f"Styling section: {key}")
-                 styled_html = style_section_html(original_html, heading)
+                 logging.debug("Styling section: %s", key)
+                 styled_html = styled_by_html.get(original_html)
+                 if styled_html is None:
+                      styled_html = style_section_html(original_html)
+                      styled_by_html[original_html] = styled_html
                  # Only update if styling actually changed the HTML
+                 # (otherwise, e.g. on a styling error, the original is kept)
                  if styled_html != original_html:
-                      updated_section_data["html"] = styled_html
+                      processed_data[key] = dict(section_data, html=styled_html)
                       styled_count += 1
-                 # Keep original HTML if styling failed or didn't change anything
-                 processed_data[key] = updated_section_data 
             else:
                  logging.warning(f"Skipping styling for section {key}: No 'html' content found.")
-                 processed_data[key] = updated_section_data # Keep copy
         else:
             logging.warning(f"Skipping styling for section {key}: Invalid format or missing 'html' key.")
-            processed_data[key] = updated_section_data # Keep copy
 
         if processed_count % 100 == 0:
              logging.info(f"Processed {processed_count}/{len(data)} sections...")
 
     logging.info(f"Styling applied to {styled_count} sections.")
+    return processed_data
+
+def _style_workers():
+    """Returns the number of styling processes, from STYLE_WORKERS."""
+    env_value = os.environ.get("STYLE_WORKERS")
+    if env_value:
+        try:
+            return max(1, int(env_value))
+        except ValueError:
+            logging.warning(f"Invalid STYLE_WORKERS value '{env_value}'. Using {DEFAULT_STYLE_WORKERS}.")
+    return DEFAULT_STYLE_WORKERS
+
+def process_json_file(input_filepath, output_filepath):
+    """Loads input JSON, applies styling to HTML, saves to output JSON."""
+    logging.info(f"--- Starting HTML Styling --- ")
+    logging.info(f"Loading data from {input_filepath}...")
+    try:
+        data = json_utils.load_file(input_filepath)
+    except FileNotFoundError:
+        logging.error(f"Input file not found: {input_filepath}")
+        print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
+        return False
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding JSON: {e}")
+        print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
+        return False
+    except Exception as e:
+        logging.error(f"Error reading input file: {e}")
+        print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
+        return False
+
+    if not isinstance(data, dict):
+         logging.error("Input JSON is not a dictionary.")
+         print(f"--- Finished HTML Styling (with error) ---", file=sys.stderr)
+         return False
+
+    processed_data = transform_dict(data, workers=_style_workers())
     logging.info(f"Saving styled data to {output_filepath}...")
     try:
         # Ensure output directory exists
@@ -235,8 +303,7 @@ def process_json_file(input_filepath, output_filepath):
         if output_dir and not os.path.exists(output_dir):
              os.makedirs(output_dir)
              
-        with open(output_filepath, 'w', encoding='utf-8') as f:
-            json.dump(processed_data, f, indent=4, ensure_ascii=False)
+        json_utils.dump_file(processed_data, output_filepath)
         logging.info("Successfully saved styled data.")
         logging.info(f"--- Finished HTML Styling --- ")
         return True
@@ -247,6 +314,21 @@ def process_json_file(input_filepath, output_filepath):
 
 
 if __name__ == "__main__":
+    # --- Configure Logging ---
+    log_file = 'style_html.log'
+    # Ensure the logs directory exists
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        try:
+            os.makedirs(log_dir)
+        except OSError as e:
+            print(f"Could not create log directory '{log_dir}': {e}", file=sys.stderr)
+
+    logging.basicConfig(level=logging.INFO, 
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.FileHandler(log_file, mode='w'), logging.StreamHandler()])
+    # --- End Logging Configuration ---
+
     if len(sys.argv) != 3:
         print(f"Usage: python {os.path.basename(__file__)} <input_converted_json> <output_styled_json>", file=sys.stderr)
         sys.exit(1)
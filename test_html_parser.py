@@ -0,0 +1,32 @@
+# test_html_parser.py
+"""
+Checks for html_parser.py.
+
+Run from the repository root with: python -m pytest test_html_parser.py
+"""
+import html_parser
+
+SECTION_HTML = '<h5><a id="_Toc4"></a>1-1  Short title</h5><p>(1) This Act.</p><p>Image {img} after</p>'
+
+
+def test_transform_html_builds_a_section():
+    sections = html_parser.transform_html(SECTION_HTML.format(img='<img src="data:image/png;base64,AAAA" />'))
+    section = sections['Section-1-1']
+    assert section['full_id'] == '1-1'
+    assert section['heading_text'] == 'Short title'
+    assert section['text_for_embedding'] == '1-1  Short title (1) This Act. Image after'
+    assert 'src="data:image/png;base64,AAAA"' in section['html']
+
+
+def test_values_over_10_mb_survive():
+    # libxml2 empties values this large unless huge_tree is set (or html.parser is used)
+    src = 'data:image/png;base64,' + 'A' * 11_000_000
+    sections = html_parser.transform_html(SECTION_HTML.format(img=f'<img src="{src}" />'))
+    section = sections['Section-1-1']
+    assert f'src="{src}"' in section['html']
+    assert section['text_for_embedding'] == '1-1  Short title (1) This Act. Image after'
+
+
+def test_clean_html_for_embedding_keeps_text_after_huge_values():
+    src = 'data:image/png;base64,' + 'A' * 11_000_000
+    assert html_parser.clean_html_for_embedding(f'<p>Before <img src="{src}"/> after</p>') == 'Before after'
@@ -0,0 +1,103 @@
+# test_style_html_content.py
+"""
+Styled-output checks for style_html_content.py.
+
+Run from the repository root with: python -m pytest test_style_html_content.py
+"""
+import pytest
+
+import style_html_content
+from style_html_content import style_section_html, transform_dict
+
+
+@pytest.mark.parametrize("html, expected", [
+    # Numbers, letters and Roman numerals (either case) get their own levels
+    (
+        '<p>(1) One</p><p>(a) Alpha</p><p>(ii) Two</p><p>(IV) Four</p><p>Body text</p>',
+        '<p class="indent-level-1">(1) One</p><p class="indent-level-2">(a) Alpha</p>'
+        '<p class="indent-level-3">(ii) Two</p><p class="indent-level-3">(IV) Four</p><p>Body text</p>',
+    ),
+    # (i) between (h) and (j) is the letter
+    (
+        '<p>(h) H</p><p>(i) I</p><p>(j) J</p>',
+        '<p class="indent-level-2">(h) H</p><p class="indent-level-2">(i) I</p><p class="indent-level-2">(j) J</p>',
+    ),
+    # Otherwise (i) is the Roman numeral
+    (
+        '<p>(1) One</p><p>(i) First</p><p>(ii) Second</p>',
+        '<p class="indent-level-1">(1) One</p><p class="indent-level-3">(i) First</p>'
+        '<p class="indent-level-3">(ii) Second</p>',
+    ),
+    # A paragraph with an anchor id is a heading, never a list item
+    (
+        '<p><a id="_Toc1"></a>(1) Heading</p>',
+        '<p class="legislation-heading"><a id="_Toc1"></a>(1) Heading</p>',
+    ),
+    # Existing classes are kept
+    (
+        '<p class="Note">(b) Note</p>',
+        '<p class="Note indent-level-2">(b) Note</p>',
+    ),
+    # Text around the paragraphs survives the wrapper element
+    (
+        'Lead <p>(2) Two</p> tail',
+        'Lead <p class="indent-level-1">(2) Two</p> tail',
+    ),
+    # Not list markers
+    (
+        '<p>()</p><p>(1a) x</p><p>(aa) y</p>',
+        '<p>()</p><p>(1a) x</p><p>(aa) y</p>',
+    ),
+])
+def test_style_section_html(html, expected):
+    assert style_section_html(html) == expected
+
+
+@pytest.mark.parametrize("html", [
+    '',
+    '<h3><a id="x"></a>Division 1</h3>',
+    '<pre>(1) code</pre>',
+])
+def test_sections_without_paragraphs_are_returned_unchanged(html):
+    assert style_section_html(html) is html
+
+
+def test_styling_is_idempotent():
+    styled = style_section_html('<p><a id="h"></a>Title</p><p>(1) One</p><p>(a) Alpha</p>')
+    assert style_section_html(styled) == styled
+
+
+def test_values_over_10_mb_survive():
+    # libxml2 empties values this large unless huge_tree is set
+    src = 'data:image/png;base64,' + 'A' * 11_000_000
+    styled = style_section_html(f'<p>(1) Figure <img src="{src}"/></p>')
+    assert styled == f'<p class="indent-level-1">(1) Figure <img src="{src}"></p>'
+
+
+def _sections(count):
+    """count sections with 10 distinct bodies, plus entries that are skipped."""
+    data = {
+        f"Section-{i}": {'html': f'<p>({i % 10 + 1}) Item</p><p>(a) Sub</p>', 'heading_text': f"Section {i}"}
+        for i in range(count)
+    }
+    data['empty'] = {'html': ''}
+    data['plain'] = {'html': '<h2>No paragraphs</h2>'}
+    return data
+
+
+def test_transform_dict_styles_changed_sections_only():
+    data = _sections(3)
+    result = transform_dict(data)
+    assert list(result) == list(data)
+    assert result['Section-1']['html'] == '<p class="indent-level-1">(2) Item</p><p class="indent-level-2">(a) Sub</p>'
+    assert result['Section-1']['heading_text'] == "Section 1"
+    assert data['Section-1']['html'] == '<p>(2) Item</p><p>(a) Sub</p>' # Input not modified
+    assert result['plain'] is data['plain']
+    assert result['empty'] is data['empty']
+
+
+def test_transform_dict_parallel_matches_serial(monkeypatch):
+    # More distinct bodies than one chunk, so the process pool is really used
+    monkeypatch.setattr(style_html_content, 'STYLE_CHUNKSIZE', 4)
+    data = _sections(40)
+    assert transform_dict(data, workers=2) == transform_dict(data)
@@ -5,28 +5,59 @@ from dotenv import load_dotenv
 import time
 import sys # Import sys for command-line arguments
 import datetime # Import datetime module
+import json_utils
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 # SOURCE_JSON_FILE = 'sections_with_embeddings.json' # Replaced by sys.argv
 SUPABASE_TABLE_NAME = 'sections' # The table name you created in Supabase
 BATCH_SIZE = 100 # Number of records to insert in one go
+UPLOAD_CONCURRENCY = 8 # Batches upserted at once (each request is mostly network wait)
+# Columns written for each section (see build_record); section_key is the upsert key
+SECTION_COLUMNS = (
+    'section_key', 'structure_type', 'full_id', 'primary_id', 'secondary_id', 'guide_target_type',
+    'html_content', 'text_content', 'char_count', 'heading_text', 'embedding',
+    'last_updated', 'act_name', 'act_compilation_dt',
+)
 # --- Configuration End ---
 
-# Load environment variables (recommended for credentials)
-load_dotenv()
+def create_supabase_client():
+    """Creates a Supabase client from SUPABASE_URL and SUPABASE_KEY.
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY") # Use Anon key or Service Role key
+    Environment variables are loaded from a .env file if present (recommended
+    for credentials). Returns None if either variable is missing.
+    """
+    load_dotenv()
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_KEY") # Use Anon key or Service Role key
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("Error: SUPABASE_URL and SUPABASE_KEY environment variables must be set.")
-    exit(1)
+    if not supabase_url or not supabase_key:
+        print("Error: SUPABASE_URL and SUPABASE_KEY environment variables must be set.")
+        return None
+    return create_client(supabase_url, supabase_key)
+
+def get_database_url():
+    """Returns SUPABASE_DB_URL, a direct Postgres connection string, or None.
+
+    When it is set and psycopg is installed, uploads bypass the REST API and
+    load sections with COPY (see copy_records()).
+    """
+    load_dotenv()
+    db_url = os.environ.get("SUPABASE_DB_URL")
+    if not db_url:
+        return None
+    try:
+        import psycopg
+    except ImportError:
+        print("Warning: SUPABASE_DB_URL is set but psycopg is not installed; uploading through the REST API.")
+        return None
+    return db_url
 
 def load_json_data(filepath):
     """Loads data from a JSON file."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = json_utils.load_file(filepath)
         print(f"Successfully loaded data from {filepath}")
         return data
     except FileNotFoundError:
@@ -39,104 +70,204 @@ def load_json_data(filepath):
         print(f"An unexpected error occurred while loading {filepath}: {e}")
         return None
 
-def main(source_json_filepath, act_name, compilation_date):
+def run(source_json_filepath, act_name, compilation_date, client=None):
+    """Reads source_json_filepath and upserts its sections into Supabase.
+
+    Sections are streamed from the file (json_utils.iter_file_items), so
+    embeddings for a large Act are not all loaded at once. See
+    upload_sections() for the arguments and return value; a file that can't
+    be read or parsed returns False (batches sent before a parse error
+    stay upserted, except with COPY, whose transaction is rolled back).
+    """
+    try:
+        return upload_sections(json_utils.iter_file_items(source_json_filepath), act_name, compilation_date, client=client)
+    except FileNotFoundError:
+        print(f"Error: Input JSON file not found at {source_json_filepath}")
+    except json_utils.JSONDecodeError as e:
+        print(f"Error: Could not decode JSON from {source_json_filepath}: {e}")
+    print("Exiting due to issues loading or validating input JSON data.")
+    print("--- Finished Supabase Upload (with error) ---") # End marker
+    return False
+
+def upload_sections(sections_data, act_name, compilation_date, client=None):
+    """Upserts the sections of a document into Supabase.
+
+    sections_data is a dict of section key -> section data (an in-memory
+    document) or an iterable of (key, data) pairs.
+
+    Pass an existing client to reuse its connection across files; otherwise
+    one is created from the environment.
+
+    Returns:
+        bool: False if no client could be created, True otherwise (individual
+        batch errors are reported but do not fail the run).
+    """
     print("--- Starting Supabase Upload ---") # Start marker
+    # Accept a datetime.date (in-process callers) or a YYYY-MM-DD string (CLI)
+    if isinstance(compilation_date, datetime.date):
+        compilation_date = compilation_date.isoformat()
     # Get the current timestamp for this run
     run_timestamp_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
     print(f"Processing Act: {act_name}")
     print(f"Compilation Date: {compilation_date}")
     print(f"Upload Timestamp (UTC): {run_timestamp_iso}")
+    items = sections_data.items() if isinstance(sections_data, dict) else sections_data
 
-    # Load the data with embeddings
-    sections_data = load_json_data(source_json_filepath)
-    if not sections_data or not isinstance(sections_data, dict):
-        print("Exiting due to issues loading or validating input JSON data.")
-        print("--- Finished Supabase Upload (with error) ---") # End marker
-        sys.exit(1)
+    db_url = get_database_url()
+    if db_url:
+        print("Loading sections with COPY over a direct database connection...")
+        start_time = time.time()
+        try:
+            copied_count = copy_records(db_url, iter_record_batches(items, act_name, compilation_date, run_timestamp_iso))
+        except (FileNotFoundError, json_utils.JSONDecodeError):
+            # Raised while reading streamed input (see run()), not by the database
+            raise
+        except Exception as e:
+            print(f"Error loading sections with COPY (nothing was written): {e}")
+            print("--- Finished Supabase Upload (with error) ---") # End marker
+            return False
+        print(f"Upserted {copied_count} records in {time.time() - start_time:.2f} seconds.")
+        print("--- Finished Supabase Upload (successfully) ---") # End marker
+        return True
 
-    # Initialize Supabase client
-    try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    # Initialize Supabase client unless the caller supplied one
+    supabase: Client = client
+    if supabase is None:
+        try:
+            supabase = create_supabase_client()
+        except Exception as e:
+            print(f"Error initializing Supabase client: {e}")
+            supabase = None
+        if supabase is None:
+            print("--- Finished Supabase Upload (with error) ---") # End marker
+            return False
         print("Supabase client initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing Supabase client: {e}")
-        print("--- Finished Supabase Upload (with error) ---") # End marker
-        sys.exit(1)
-
-    # Prepare data for batch insertion
-    records_to_insert = []
-    for key, data in sections_data.items():
-        # **Important:** Adapt this mapping to your exact JSON structure and Supabase table columns
-        record = {
-            'section_key': key, # Assuming the dict key is the unique section identifier
-            'structure_type': data.get('structure_type'),
-            'full_id': data.get('full_id'),
-            'primary_id': data.get('primary_id'),
-            'secondary_id': data.get('secondary_id'),
-            'guide_target_type': data.get('guide_target_type'), # Might be None if not a guide
-            'html_content': data.get('html'), # Map 'html' from JSON to 'html_content' column
-            'text_content': data.get('text_for_embedding'), # Map 'text_for_embedding' to 'text_content'
-            'char_count': data.get('char_count'),
-            'heading_text': data.get('heading_text'),
-            'embedding': data.get('embedding'), # Ensure this key exists and contains the list of floats
-            'last_updated': run_timestamp_iso, # Add the timestamp for this run
-            'act_name': act_name, # Add the act name passed as argument
-            'act_compilation_dt': compilation_date # Add the compilation date passed as argument
-        }
-        # Add only if embedding exists to avoid errors
-        if record['embedding'] and record['section_key']: # Also check key exists
-            records_to_insert.append(record)
-        else:
-            print(f"Warning: Skipping section '{key or 'UNKNOWN'}' because 'embedding' or 'section_key' data is missing.")
 
-    total_records = len(records_to_insert)
-    print(f"Prepared {total_records} records for insertion.")
-
-    if not records_to_insert:
-        print("No records to insert.")
-        print("--- Finished Supabase Upload (no records) ---") # End marker
-        sys.exit(0)
-
-    # Insert data in batches
-    print(f"Starting batch insertion (batch size: {BATCH_SIZE})...")
+    # Records are built one batch at a time and up to UPLOAD_CONCURRENCY
+    # batches are upserted concurrently (the client's HTTP session is shared
+    # by the threads). Sections streamed from a file (see run()) are never
+    # all held in memory: at most that many batches are pending at once.
+    print(f"Starting batch insertion (batch size: {BATCH_SIZE}, {UPLOAD_CONCURRENCY} concurrent)...")
     start_time = time.time()
+    prepared_count = 0
     inserted_count = 0
-    for i in range(0, total_records, BATCH_SIZE):
-        batch = records_to_insert[i:i + BATCH_SIZE]
-        try:
-            # Use upsert=False if you want duplicates to cause errors instead of updates
-            # data, count = supabase.table(SUPABASE_TABLE_NAME).insert(batch, upsert=False).execute()
-            # Using upsert=True might be safer if you might re-run the script
-            # It requires specifying the 'on_conflict' column (your primary key or unique constraint)
-            # Example: Assuming 'section_key' is a unique column in your Supabase table
-            # Assign to underscore '_' to indicate the variable is intentionally unused
-            _ = supabase.table(SUPABASE_TABLE_NAME).upsert(batch, on_conflict='section_key').execute()
-
-            # Simple count check (actual response structure might vary slightly)
-            # Note: Supabase Python v1+ response might differ, check library docs if needed.
-            # A successful insert/upsert might not return a detailed count in older versions.
-            # Check for errors in the response if available.
-            # if response.get('error'):
-            #    print(f"Error inserting batch starting at index {i}: {response['error']}")
-            # else:
-            #    inserted_count += len(batch) # Assuming success if no error
-            #    print(f"Inserted batch {i // BATCH_SIZE + 1}/{(total_records + BATCH_SIZE - 1) // BATCH_SIZE}...")
-
-            # Simplified success metric for now
-            inserted_count += len(batch)
-            print(f"Processed batch {i // BATCH_SIZE + 1}/{(total_records + BATCH_SIZE - 1) // BATCH_SIZE}...")
-
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upsert") as executor:
+        in_flight = deque()
+        for batch in iter_record_batches(items, act_name, compilation_date, run_timestamp_iso):
+            if len(in_flight) == UPLOAD_CONCURRENCY:
+                inserted_count += in_flight.popleft().result() # Wait for the oldest batch
+            in_flight.append(executor.submit(upsert_batch, supabase, batch, prepared_count))
+            prepared_count += len(batch)
+        inserted_count += sum(future.result() for future in in_flight)
 
-        except Exception as e:
-            print(f"Error inserting batch starting at index {i}: {e}")
-            # Decide if you want to stop or continue on error
-            # break # Uncomment to stop on first error
+    if not prepared_count:
+        print("No records to insert.")
+        print("--- Finished Supabase Upload (no records) ---") # End marker
+        return True
 
     end_time = time.time()
     print(f"\nFinished insertion.")
-    print(f"Attempted to insert/upsert {inserted_count} records (out of {total_records} prepared).")
+    print(f"Attempted to insert/upsert {inserted_count} records (out of {prepared_count} prepared).")
     print(f"Total time: {end_time - start_time:.2f} seconds.")
     print("--- Finished Supabase Upload (successfully) ---") # End marker
+    return True
+
+def build_record(key, data, act_name, compilation_date, run_timestamp_iso):
+    """Maps one section of the pipeline JSON to a row of the sections table."""
+    embedding = data.get('embedding')
+    if embedding is not None and not isinstance(embedding, str) and len(embedding):
+        # numpy row (in-process) or list of floats (read from JSON)
+        embedding = json_utils.format_pgvector(embedding)
+    # **Important:** Adapt this mapping to your exact JSON structure and Supabase table columns
+    return {
+        'section_key': key, # Assuming the dict key is the unique section identifier
+        'structure_type': data.get('structure_type'),
+        'full_id': data.get('full_id'),
+        'primary_id': data.get('primary_id'),
+        'secondary_id': data.get('secondary_id'),
+        'guide_target_type': data.get('guide_target_type'), # Might be None if not a guide
+        'html_content': data.get('html'), # Map 'html' from JSON to 'html_content' column
+        'text_content': data.get('text_for_embedding'), # Map 'text_for_embedding' to 'text_content'
+        'char_count': data.get('char_count'),
+        'heading_text': data.get('heading_text'),
+        'embedding': embedding, # Ensure this key exists and contains the list of floats
+        'last_updated': run_timestamp_iso, # Add the timestamp for this run
+        'act_name': act_name, # Add the act name passed as argument
+        'act_compilation_dt': compilation_date # Add the compilation date passed as argument
+    }
+
+def copy_records(db_url, record_batches):
+    """Upserts records into the sections table with COPY; returns how many.
+
+    Rows are streamed into a temporary staging table with COPY (no JSON,
+    no per-request overhead) and merged with INSERT ... ON CONFLICT
+    (section_key) DO UPDATE, the same upsert the REST path performs. Runs
+    in one transaction, so a failure writes nothing.
+    """
+    import psycopg
+    from psycopg import sql
+
+    columns = sql.SQL(', ').join(map(sql.Identifier, SECTION_COLUMNS))
+    updates = sql.SQL(', ').join(
+        sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(column)) for column in SECTION_COLUMNS[1:]
+    )
+    table = sql.Identifier(SUPABASE_TABLE_NAME)
+    count = 0
+    with psycopg.connect(db_url) as conn, conn.cursor() as cur:
+        # Same column types as the target table, without its constraints or other columns
+        cur.execute(sql.SQL(
+            "CREATE TEMP TABLE sections_staging ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA"
+        ).format(columns=columns, table=table))
+        with cur.copy(sql.SQL("COPY sections_staging ({columns}) FROM STDIN").format(columns=columns)) as copy:
+            for batch in record_batches:
+                for record in batch:
+                    # The embedding is already a pgvector literal (see build_record)
+                    copy.write_row([record[column] for column in SECTION_COLUMNS])
+                count += len(batch)
+        cur.execute(sql.SQL(
+            "INSERT INTO {table} ({columns}) SELECT {columns} FROM sections_staging "
+            "ON CONFLICT (section_key) DO UPDATE SET {updates}"
+        ).format(table=table, columns=columns, updates=updates))
+    return count
+
+def iter_record_batches(items, act_name, compilation_date, run_timestamp_iso):
+    """Yields lists of up to BATCH_SIZE records built from (key, data) pairs.
+
+    Sections without an embedding or key are reported and left out.
+    """
+    batch = []
+    for key, data in items:
+        record = build_record(key, data, act_name, compilation_date, run_timestamp_iso)
+        # Add only if embedding exists to avoid errors
+        if record['embedding'] and record['section_key']: # Also check key exists
+            batch.append(record)
+        else:
+            print(f"Warning: Skipping section '{key or 'UNKNOWN'}' because 'embedding' or 'section_key' data is missing.")
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def upsert_batch(supabase, batch, start_index):
+    """Upserts one batch of records; returns how many were sent (0 if it failed).
+
+    start_index is the position of the batch's first record in the upload,
+    used in progress and error messages.
+    """
+    try:
+        # Upsert on section_key (a unique column in the sections table), so re-running
+        # the upload updates existing rows instead of failing on duplicates
+        supabase.table(SUPABASE_TABLE_NAME).upsert(batch, on_conflict='section_key').execute()
+    except Exception as e:
+        print(f"Error inserting batch starting at index {start_index}: {e}")
+        return 0
+    print(f"Processed batch {start_index // BATCH_SIZE + 1} (records {start_index + 1}-{start_index + len(batch)})...")
+    return len(batch)
+
+def main(source_json_filepath, act_name, compilation_date):
+    if not run(source_json_filepath, act_name, compilation_date):
+        sys.exit(1)
 
 if __name__ == "__main__":
     # Expect three arguments: input JSON path, act name, compilation date